@@ -1,49 +1,82 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from models import db, User, Role
 from config import Config
+from database import init_db
+from cache import load_principal
+from audit import init_audit
+from mailer import init_mailer
+from security import init_security
+from templating import init_templating
+from responses import init_responses
+from metrics import init_metrics
+from slowlog import init_slowlog
+from scheduler import init_scheduler
+from commands import register_commands
 from blueprints.auth import auth_bp
 from blueprints.admin import admin_bp
 from blueprints.main import main_bp
 from blueprints.general import general_bp
+from blueprints.api import api_bp
 
-app = Flask(__name__)
-app.config.from_object(Config)
+# Фабрика приложения. Модуль только импортирует зависимости, само приложение создаёт create_app():
+#   flask --app app ...                      - команды (схема базы: flask init-db, администратор: flask create-admin)
+#   python app.py                            - сервер разработки, один процесс
+#   gunicorn -c gunicorn.conf.py wsgi:app    - рабочий режим, несколько процессов (см. wsgi.py)
+# Фоновые потоки (письма, задачи обслуживания, журнал медленных запросов) запускаются в каждом процессе
+# при первом запросе, поэтому приложение можно создать в главном процессе до запуска воркеров.
 
-# Инициализация базы данных
-db.init_app(app)
-
-
-# Инициализация Flask-Login
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return load_principal(int(user_id))
+
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # Инициализация базы данных (пул соединений и PRAGMA, см. database.py)
+    init_db(app)
+
+    # Метрики Prometheus на /metrics: время запросов, SQL, пул соединений, SMTP, кэши
+    init_metrics(app)
+
+    # Журнал медленных SQL-запросов с планами EXPLAIN QUERY PLAN (страница /admin/slow_queries)
+    init_slowlog(app)
+
+    # Сжатие ответов и статические файлы с отпечатком; регистрируется первым, чтобы сжатие выполнялось последним
+    init_responses(app)
+
+    # Автоматический журнал изменений (таблица logs)
+    init_audit(app)
+
+    # Фоновая отправка писем из очереди email_outbox
+    init_mailer(app)
+
+    # Пул хэширования паролей: при перегрузке - сообщение вместо ошибки 500
+    init_security(app)
+
+    # Кэш байткода шаблонов на диске и тег {% cache %} для фрагментов
+    init_templating(app)
+
+    # Фоновые задачи обслуживания: очистка просроченных токенов и приглашений, статистика SQLite
+    init_scheduler(app)
+
+    # Инициализация Flask-Login
+    login_manager.init_app(app)
+
+    # Регистрация Blueprint'ов
+    app.register_blueprint(auth_bp, url_prefix='/')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(main_bp, url_prefix='/')
+    app.register_blueprint(general_bp, url_prefix='/')
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
 
-# Регистрация Blueprint'ов
-app.register_blueprint(auth_bp, url_prefix='/')
-app.register_blueprint(admin_bp, url_prefix='/admin')
-app.register_blueprint(main_bp, url_prefix='/')
-app.register_blueprint(general_bp, url_prefix='/')
+    # Команды flask (commands.py)
+    register_commands(app)
+    return app
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        # Добавим тестовые роли, если их нет
-        if not Role.query.filter_by(name='Администратор').first():
-            admin_role = Role(name='Администратор', description='Полный доступ к системе')
-            db.session.add(admin_role)
-            db.session.commit()
-        if not Role.query.filter_by(name='Менеджер').first():
-            manager_role = Role(name='Менеджер', description='Управление клиентами')
-            db.session.add(manager_role)
-            db.session.commit()
-        if not Role.query.filter_by(name='Декларант').first():
-            employee_role = Role(name='Декларант', description='Ограниченный доступ')
-            db.session.add(employee_role)
-            db.session.commit()
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Сервер разработки. Таблицы и роли создаёт `flask init-db`, а не запуск сервера.
+    create_app().run(host='0.0.0.0', port=5000)
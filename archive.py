@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import time
+import zlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from flask import current_app
+from sqlalchemy import select, delete
+from models import db, Log, LogChange, User
+
+# Архивирование журнала изменений: записи logs старше LOG_RETENTION_DAYS дней переносятся
+# в отдельный файл SQLite (LOG_ARCHIVE_PATH, по умолчанию <имя базы>_archive.db) со сжатыми zlib деталями.
+# Архив только пополняется. Перенос идёт пачками по LOG_ARCHIVE_BATCH_SIZE записей, каждая пачка -
+# короткая транзакция, между пачками пауза LOG_ARCHIVE_PAUSE секунд, чтобы не держать блокировку записи.
+
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS archived_logs (
+        log_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        record_id INTEGER NOT NULL,
+        details BLOB,
+        created_at TEXT,
+        archived_at TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS ix_archived_logs_table_name_record_id_log_id ON archived_logs (table_name, record_id, log_id)',
+]
+
+
+def archive_path():
+    path = current_app.config.get('LOG_ARCHIVE_PATH')
+    if path:
+        return path
+    return os.path.splitext(db.engine.url.database)[0] + '_archive.db'
+
+
+def _connect_archive(path, readonly=False):
+    if readonly:
+        return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    connection = sqlite3.connect(path)
+    for statement in ARCHIVE_SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+def archive_logs(days=None):
+    # Переносит старые записи журнала в архив. Возвращает количество перенесённых записей.
+    days = current_app.config.get('LOG_RETENTION_DAYS', 365) if days is None else days
+    batch_size = current_app.config.get('LOG_ARCHIVE_BATCH_SIZE', 1000)
+    pause = current_app.config.get('LOG_ARCHIVE_PAUSE', 0.05)
+    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    archive = _connect_archive(archive_path())
+    moved = 0
+    try:
+        while True:
+            rows = db.session.execute(
+                select(Log.log_id, Log.user_id, Log.action, Log.table_name, Log.record_id, Log.details, Log.created_at)
+                .where(Log.created_at < cutoff)
+                .order_by(Log.created_at)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            archived_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+            # Сначала запись в архив (повторный перенос той же записи игнорируется), затем удаление из logs:
+            # при сбое между шагами запись останется в обеих базах и будет удалена следующим запуском
+            archive.executemany(
+                'INSERT OR IGNORE INTO archived_logs VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(row.log_id, row.user_id, row.action, row.table_name, row.record_id,
+                  zlib.compress(row.details.encode()) if row.details is not None else None,
+                  str(row.created_at), archived_at) for row in rows]
+            )
+            archive.commit()
+            log_ids = [row.log_id for row in rows]
+            db.session.execute(delete(LogChange).where(LogChange.log_id.in_(log_ids)))
+            db.session.execute(delete(Log).where(Log.log_id.in_(log_ids)))
+            db.session.commit()
+            moved += len(rows)
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+    finally:
+        archive.close()
+    return moved
+
+
+def archived_record_logs(table_name, record_id):
+    # История записи из архива, от новых к старым; объекты совместимы с шаблоном admin/logs.html
+    path = archive_path()
+    if not os.path.exists(path):
+        return []
+    archive = _connect_archive(path, readonly=True)
+    try:
+        rows = archive.execute(
+            'SELECT log_id, user_id, action, table_name, record_id, details, created_at FROM archived_logs '
+            'WHERE table_name = ? AND record_id = ? ORDER BY log_id DESC',
+            (table_name, record_id)
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Архив ещё не создан
+        return []
+    finally:
+        archive.close()
+    user_ids = {row[1] for row in rows}
+    users = {user.user_id: user for user in User.query.filter(User.user_id.in_(user_ids)).all()} if user_ids else {}
+    return [SimpleNamespace(
+        log_id=log_id, user=users.get(user_id), action=action, table_name=table, record_id=record,
+        details=zlib.decompress(details).decode() if details is not None else None, created_at=created_at
+    ) for log_id, user_id, action, table, record, details, created_at in rows]
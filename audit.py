@@ -0,0 +1,222 @@
+import atexit
+import json
+import os
+import threading
+from datetime import datetime
+from flask import current_app, has_request_context
+from flask_login import current_user
+from sqlalchemy import event, insert, inspect
+from sqlalchemy.orm import Session
+from models import db, GeneralData, ExportContract, Log, LogChange
+
+# Журнал изменений (таблица logs) ведётся автоматически по событиям сессии SQLAlchemy.
+#
+# Режимы (настройка AUDIT_MODE):
+#   'sync'     - записи лога вставляются в той же транзакции, что и изменение (по умолчанию, гарантия сохранности)
+#   'buffered' - после commit записи попадают в буфер процесса, а фоновый поток пишет их пачками
+#                по AUDIT_BATCH_SIZE не реже раза в AUDIT_FLUSH_INTERVAL секунд. Записи буфера,
+#                не успевшие сохраниться до аварийного завершения процесса, теряются.
+#
+# Автор изменения берётся из session.info['audit_user_id'], а если его нет - из current_user.
+
+# Модель -> (имя таблицы в логе, поля в деталях лога)
+AUDITED_MODELS = {
+    GeneralData: ('general_data', ('client_id', 'gateway_id', 'terminal_id', 'export_contract_id', 'vehicle', 'invoice_number', 'delivery_address')),
+    ExportContract: ('export_contracts', ('number', 'date', 'client_id')),
+}
+
+
+def _serialize(value):
+    # Даты пишутся строкой, как раньше str(contract.date)
+    if value is not None and not isinstance(value, (int, float, str, bool)):
+        return str(value)
+    return value
+
+
+def _details(obj, fields):
+    return {field: _serialize(getattr(obj, field)) for field in fields}
+
+
+def _old_details(obj, fields):
+    state = inspect(obj)
+    old = {}
+    for field in fields:
+        history = state.attrs[field].history
+        old[field] = _serialize(history.deleted[0]) if history.deleted else _serialize(getattr(obj, field))
+    return old
+
+
+def _record_id(obj):
+    return inspect(obj).mapper.primary_key_from_instance(obj)[0]
+
+
+def _user_id(session):
+    if 'audit_user_id' in session.info:
+        return session.info['audit_user_id']
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.user_id
+    return None
+
+
+def make_entry(user_id, action, table_name, record_id, details):
+    return {
+        'user_id': user_id,
+        'action': action,
+        'table_name': table_name,
+        'record_id': record_id,
+        'details': json.dumps(details, ensure_ascii=False),
+        'created_at': datetime.utcnow(),
+    }
+
+
+def _text(value):
+    # Значения в log_changes хранятся текстом, как их отдаёт json_each в миграции 4
+    return None if value is None else str(value)
+
+
+def _change_rows(log_id, action, details):
+    details = json.loads(details)
+    if action == 'update':
+        old, new = details.get('old', {}), details.get('new', {})
+        return [{'log_id': log_id, 'field': field, 'old_value': _text(old.get(field)), 'new_value': _text(value),
+                 'changed': old.get(field) != value} for field, value in new.items()]
+    side = 'new_value' if action == 'create' else 'old_value'
+    return [{'log_id': log_id, 'field': field, 'old_value': None, 'new_value': None, side: _text(value), 'changed': True}
+            for field, value in details.items()]
+
+
+def write_entries(connection, entries):
+    # Вставляет записи лога и их построчные изменения в log_changes
+    rows = connection.execute(insert(Log).returning(Log.log_id, Log.action, Log.details), entries).all()
+    changes = [change for row in rows for change in _change_rows(row.log_id, row.action, row.details)]
+    if changes:
+        connection.execute(insert(LogChange), changes)
+
+
+def _pending(session, key):
+    return session.info.setdefault(key, [])
+
+
+def _before_flush(session, flush_context, instances):
+    # Изменения и удаления фиксируются до flush, пока доступны история атрибутов и старые значения
+    user_id = _user_id(session)
+    entries = _pending(session, 'audit_flush')
+    for obj in session.dirty:
+        audited = AUDITED_MODELS.get(type(obj))
+        if not audited or not session.is_modified(obj, include_collections=False):
+            continue
+        table_name, fields = audited
+        old_values = _old_details(obj, fields)
+        new_values = _details(obj, fields)
+        if old_values != new_values:
+            entries.append(make_entry(user_id, 'update', table_name, _record_id(obj), {'old': old_values, 'new': new_values}))
+    for obj in session.deleted:
+        audited = AUDITED_MODELS.get(type(obj))
+        if audited:
+            table_name, fields = audited
+            entries.append(make_entry(user_id, 'delete', table_name, _record_id(obj), _details(obj, fields)))
+
+
+def _after_flush(session, flush_context):
+    # Созданные записи фиксируются после flush, когда уже известен их id
+    user_id = _user_id(session)
+    entries = session.info.pop('audit_flush', [])
+    for obj in session.new:
+        audited = AUDITED_MODELS.get(type(obj))
+        if audited:
+            table_name, fields = audited
+            entries.append(make_entry(user_id, 'create', table_name, _record_id(obj), _details(obj, fields)))
+    record(session, entries)
+
+
+def record(session, entries):
+    # Записывает готовые записи лога с учётом режима; используется и для массовых операций в обход ORM
+    entries = [entry for entry in entries if entry['user_id'] is not None]
+    if not entries:
+        return
+    if current_app.config.get('AUDIT_MODE', 'sync') == 'buffered':
+        _pending(session, 'audit_commit').extend(entries)
+    else:
+        write_entries(session.connection(), entries)
+
+
+def _after_commit(session):
+    entries = session.info.pop('audit_commit', None)
+    if entries:
+        get_writer(current_app._get_current_object()).add(entries)
+
+
+def _after_rollback(session):
+    session.info.pop('audit_flush', None)
+    session.info.pop('audit_commit', None)
+
+
+class AuditWriter(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='audit-writer', daemon=True)
+        self.app = app
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 500)
+        self.interval = app.config.get('AUDIT_FLUSH_INTERVAL', 1.0)
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def add(self, entries):
+        with self.lock:
+            self.buffer.extend(entries)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        while True:
+            with self.lock:
+                batch, self.buffer = self.buffer[:self.batch_size], self.buffer[self.batch_size:]
+            if not batch:
+                return
+            with self.app.app_context():
+                try:
+                    with db.engine.begin() as connection:
+                        write_entries(connection, batch)
+                except Exception:
+                    # Возвращаем пачку в буфер, чтобы повторить при следующем проходе
+                    with self.lock:
+                        self.buffer[:0] = batch
+                    self.app.logger.exception("Ошибка записи журнала изменений")
+                    return
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(app):
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = AuditWriter(app)
+            _writer_pid = os.getpid()
+            _writer.start()
+            atexit.register(_writer.flush)
+    return _writer
+
+
+def flush_buffer():
+    # Принудительно сохраняет буфер (например, перед завершением процесса или в тестах)
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.flush()
+
+
+def init_audit(app):
+    if not event.contains(Session, 'before_flush', _before_flush):
+        event.listen(Session, 'before_flush', _before_flush)
+        event.listen(Session, 'after_flush', _after_flush)
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_rollback', _after_rollback)
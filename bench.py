@@ -0,0 +1,349 @@
+import contextvars
+import json
+import random
+import secrets
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from sqlalchemy import event, insert, select, func
+from models import db, Client, User, Gateway, Terminal, ExportContract, GeneralData, Log
+from audit import make_entry, write_entries
+from cache import bump_version
+from security import hash_password, RATE_LIMITS
+from seed import ROLES, ensure_role
+
+# Генератор синтетических данных и нагрузочные замеры основных страниц.
+#
+#   flask generate-data --rows 1000000 --logs 1000000
+#   flask benchmark --sizes 10000,100000,1000000 --save bench_baseline.json
+#   flask benchmark --sizes 10000,100000,1000000 --compare bench_baseline.json
+#
+# Замеры идут через тестовый клиент Flask по настоящим маршрутам и базе из конфигурации приложения,
+# поэтому запускать их следует на отдельной копии базы. Размеры --sizes достигаются дозаполнением
+# general_data перед каждым этапом, так что база только растёт. Пользователи bench-* создаются отключёнными
+# и входят в систему только во время замеров, с паролем, случайным для каждого запуска.
+
+BENCH_ADMIN_EMAIL = 'bench-admin@example.com'
+BENCH_USER_EMAIL = 'bench-user@example.com'
+
+STREETS = ['Абая', 'Достык', 'Аль-Фараби', 'Толе би', 'Сейфуллина', 'Жибек жолы', 'Кабанбай батыра', 'Республики']
+CITIES = ['Алматы', 'Астана', 'Шымкент', 'Караганда', 'Актобе', 'Павлодар']
+PLATE_LETTERS = 'ABCEHKMOPTXY'
+
+
+def _vehicle(rng):
+    # Госномер вида 123ABC02; каждая пятая запись без транспортного средства
+    if rng.random() < 0.2:
+        return None
+    letters = ''.join(rng.choice(PLATE_LETTERS) for _ in range(3))
+    return f'{rng.randint(1, 999):03d}{letters}{rng.randint(1, 20):02d}'
+
+
+def _address(rng):
+    if rng.random() < 0.1:
+        return None
+    return f'г. {rng.choice(CITIES)}, ул. {rng.choice(STREETS)}, д. {rng.randint(1, 300)}'
+
+
+def _ensure_user(username, email, role, client_id=None):
+    # Пользователи замеров создаются отключёнными и с паролем, который никто не знает: benchmark включает
+    # их только на время своей работы со случайным паролем (см. _enable_bench_users)
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        user = User(username=username, email=email, password_hash=hash_password(secrets.token_urlsafe(32)),
+                    role_id=role.role_id, client_id=client_id, is_active=False)
+        db.session.add(user)
+        db.session.flush()
+    return user
+
+
+def ensure_bench_users():
+    roles = {name: ensure_role(name, description) for name, description in ROLES}
+    client_id = db.session.execute(select(Client.client_id).order_by(Client.client_id).limit(1)).scalar()
+    admin = _ensure_user('bench_admin', BENCH_ADMIN_EMAIL, roles['Администратор'])
+    _ensure_user('bench_user', BENCH_USER_EMAIL, roles['Декларант'], client_id)
+    return admin
+
+
+def _set_bench_users(active):
+    # Новый случайный пароль на каждый запуск; после замеров пользователи снова отключаются
+    password = secrets.token_urlsafe(16)
+    for user in User.query.filter(User.email.in_([BENCH_ADMIN_EMAIL, BENCH_USER_EMAIL])):
+        user.password_hash = hash_password(password)
+        user.is_active = active
+    bump_version('users')
+    db.session.commit()
+    return password
+
+
+def _enable_bench_users():
+    ensure_bench_users()
+    return _set_bench_users(True)
+
+
+def _insert_batches(model, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(model), rows[start:start + batch_size])
+
+
+def ensure_references(clients=20, gateways=10, terminals=30, contracts=200, seed=1):
+    # Дополняет справочники до указанного количества и создаёт пользователей для замеров
+    rng = random.Random(seed)
+    for model, name_column, count, prefix, version in (
+        (Client, Client.name, clients, 'Клиент', 'clients'),
+        (Gateway, Gateway.name, gateways, 'Шлюз', 'gateways'),
+        (Terminal, Terminal.name, terminals, 'Терминал', 'terminals'),
+    ):
+        existing = db.session.execute(select(func.count()).select_from(model)).scalar()
+        if existing < count:
+            _insert_batches(model, [{name_column.key: f'{prefix} {i}'} for i in range(existing + 1, count + 1)], 1000)
+            bump_version(version)
+    client_ids = db.session.execute(select(Client.client_id)).scalars().all()
+    admin = ensure_bench_users()
+    existing = db.session.execute(select(func.count()).select_from(ExportContract)).scalar()
+    if existing < contracts:
+        today = datetime.utcnow().date()
+        _insert_batches(ExportContract, [{
+            'number': f'EC-{i:06d}',
+            'date': today - timedelta(days=rng.randint(0, 730)),
+            'client_id': rng.choice(client_ids),
+            'created_by': admin.user_id,
+        } for i in range(existing + 1, contracts + 1)], 1000)
+        bump_version('export_contracts')
+    db.session.commit()
+    return admin
+
+
+def generate_general_data(count, batch_size=10000, days=365, seed=1, progress=None):
+    # Быстрая вставка count записей general_data пачками через executemany; created_at растёт вместе с id
+    rng = random.Random(seed)
+    admin = ensure_references(seed=seed)
+    user_ids = db.session.execute(select(User.user_id)).scalars().all()
+    gateway_ids = db.session.execute(select(Gateway.gateway_id)).scalars().all()
+    terminal_ids = db.session.execute(select(Terminal.terminal_id)).scalars().all()
+    contracts = db.session.execute(select(ExportContract.export_contract_id, ExportContract.client_id)).all()
+    start_id = db.session.execute(select(func.max(GeneralData.id))).scalar() or 0
+    started_at = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / max(count, 1)
+    inserted = 0
+    while inserted < count:
+        rows = []
+        for i in range(inserted, min(inserted + batch_size, count)):
+            contract_id, client_id = rng.choice(contracts)
+            rows.append({
+                'client_id': client_id,
+                'user_id': rng.choice(user_ids) if rng.random() < 0.5 else admin.user_id,
+                'gateway_id': rng.choice(gateway_ids),
+                'terminal_id': rng.choice(terminal_ids),
+                'export_contract_id': contract_id,
+                'vehicle': _vehicle(rng),
+                'invoice_number': f'INV-{start_id + i + 1:08d}',
+                'delivery_address': _address(rng),
+                'created_at': (started_at + step * i).replace(microsecond=0),
+            })
+        db.session.execute(insert(GeneralData), rows)
+        db.session.commit()
+        inserted += len(rows)
+        if progress:
+            progress(inserted, count)
+    return inserted
+
+
+def generate_logs(count, batch_size=5000, seed=1, progress=None):
+    # Записи журнала по существующим general_data: 'create' и 'update' с заполнением log_changes
+    rng = random.Random(seed)
+    admin = ensure_references(seed=seed)
+    max_id = db.session.execute(select(func.max(GeneralData.id))).scalar()
+    if not max_id:
+        return 0
+    fields = ('client_id', 'gateway_id', 'terminal_id', 'export_contract_id', 'vehicle', 'invoice_number', 'delivery_address')
+    inserted = 0
+    while inserted < count:
+        size = min(batch_size, count - inserted)
+        ids = [rng.randint(1, max_id) for _ in range(size)]
+        rows = {row.id: row for row in db.session.execute(select(GeneralData).where(GeneralData.id.in_(set(ids)))).scalars()}
+        entries = []
+        for record_id in ids:
+            row = rows.get(record_id)
+            if row is None:
+                continue
+            details = {field: getattr(row, field) for field in fields}
+            if rng.random() < 0.5:
+                entries.append(make_entry(admin.user_id, 'create', 'general_data', record_id, details))
+            else:
+                new = dict(details, vehicle=_vehicle(rng), delivery_address=_address(rng))
+                entries.append(make_entry(admin.user_id, 'update', 'general_data', record_id, {'old': details, 'new': new}))
+        if not entries:
+            break
+        write_entries(db.session.connection(), entries)
+        db.session.commit()
+        db.session.expunge_all()
+        inserted += len(entries)
+        if progress:
+            progress(inserted, count)
+    return inserted
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _login(client, email, password):
+    client.get('/logout')
+    response = client.post('/login', data={'email': email, 'password': password})
+    if response.status_code != 302:
+        raise RuntimeError(f'Не удалось войти как {email}')
+
+
+def scenarios(per_page_sizes, password):
+    # (имя, email пользователя, метод, url, данные формы)
+    items = []
+    for per_page in per_page_sizes:
+        items += [
+            (f'general.index per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET', f'/general?per_page={per_page}', None),
+            (f'general.index client user per_page={per_page}', BENCH_USER_EMAIL, 'GET', f'/general?per_page={per_page}', None),
+            (f'general.index terminal+date per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET',
+             f'/general?per_page={per_page}&terminal_id=1&date_from={(datetime.utcnow() - timedelta(days=30)).date()}', None),
+            (f'general.index sort=vehicle per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET', f'/general?per_page={per_page}&sort=vehicle&order=asc', None),
+            (f'general.index search per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET', f'/general?per_page={per_page}&q=INV-0000', None),
+            (f'admin.admin_logs per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET', f'/admin/logs?per_page={per_page}', None),
+            (f'admin.admin_logs field filter per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET',
+             f'/admin/logs?per_page={per_page}&field=terminal_id&value=1', None),
+            (f'api.general_data per_page={per_page}', BENCH_ADMIN_EMAIL, 'GET', f'/api/v1/general_data?per_page={per_page}', None),
+        ]
+    items.append(('auth.login', None, 'POST', '/login', {'email': BENCH_ADMIN_EMAIL, 'password': password}))
+    return items
+
+
+def _request(client, method, url, data):
+    if method == 'POST' and url == '/login':
+        client.get('/logout')
+    response = client.open(url, method=method, data=data)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{url}: ответ {response.status_code}')
+
+
+def run_scenario(client, engine, scenario, iterations, password, memory_iterations=3):
+    # Запросы выполняются вне контекста приложения, чтобы каждый получал свой g, как в работе.
+    # Пик памяти снимается отдельными прогонами: tracemalloc заметно замедляет выполнение.
+    name, email, method, url, data = scenario
+    if email:
+        _login(client, email, password)
+    timings, queries, peaks = [], [], []
+    with QueryCounter(engine) as counter:
+        for _ in range(iterations):
+            counter.count = 0
+            started = time.perf_counter()
+            _request(client, method, url, data)
+            timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.count)
+    for _ in range(min(memory_iterations, iterations)):
+        tracemalloc.start()
+        _request(client, method, url, data)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(_percentile(timings, 50), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+        'queries': round(statistics.mean(queries), 1),
+        'peak_kib': round(max(peaks), 1),
+    }
+
+
+def run_benchmark(app, sizes, per_page_sizes=(10, 50), iterations=20, progress=None):
+    # Возвращает {размер: {сценарий: метрики}}. Выполняется в пустом контексте contextvars: команды flask
+    # работают внутри контекста приложения, и без этого g (кэш версий данных) был бы общим для всех запросов.
+    return contextvars.Context().run(_run_benchmark, app, sizes, per_page_sizes, iterations, progress)
+
+
+def _run_benchmark(app, sizes, per_page_sizes, iterations, progress):
+    results = {}
+    csrf = app.config.get('WTF_CSRF_ENABLED', True)
+    scheduler = app.config.get('SCHEDULER_ENABLED', True)
+    rate_limits = app.config.get('RATE_LIMITS', {})
+    # Формы входа отправляются тестовым клиентом без CSRF-токена; задачи обслуживания не должны искажать замеры.
+    # Вход выполняется на каждом повторе сценария, поэтому ограничение частоты попыток снимается.
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SCHEDULER_ENABLED'] = False
+    app.config['RATE_LIMITS'] = {name: (10 ** 9, 1) for name in RATE_LIMITS}
+    try:
+        for size in sizes:
+            with app.app_context():
+                engine = db.engine
+                existing = db.session.execute(select(func.count()).select_from(GeneralData)).scalar()
+                if existing < size:
+                    generate_general_data(size - existing, progress=progress)
+                if db.session.execute(select(func.count()).select_from(Log)).scalar() < size // 10:
+                    generate_logs(size // 10, progress=progress)
+                db.session.execute(db.text('PRAGMA optimize'))
+                password = _enable_bench_users()
+            client = app.test_client()
+            # Разогрев кэшей справочников и пользователя
+            _login(client, BENCH_ADMIN_EMAIL, password)
+            client.get('/general')
+            results[str(size)] = {scenario[0]: run_scenario(client, engine, scenario, iterations, password)
+                                  for scenario in scenarios(per_page_sizes, password)}
+    finally:
+        with app.app_context():
+            _set_bench_users(False)
+        app.config['WTF_CSRF_ENABLED'] = csrf
+        app.config['SCHEDULER_ENABLED'] = scheduler
+        app.config['RATE_LIMITS'] = rate_limits
+    return results
+
+
+def compare(results, baseline, threshold=20):
+    # Строки сравнения с базовыми замерами и признак регрессии p95 больше threshold процентов
+    lines, regressed = [], False
+    for size, scenario_results in results.items():
+        for name, metrics in scenario_results.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                lines.append(f'{size:>9} {name:<48} p95 {metrics["p95_ms"]:>9.2f} мс (нет в базовых замерах)')
+                continue
+            change = (metrics['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0
+            mark = ''
+            if change > threshold or metrics['queries'] > base['queries']:
+                mark = '  <-- регрессия'
+                regressed = True
+            lines.append(f'{size:>9} {name:<48} p95 {base["p95_ms"]:>9.2f} -> {metrics["p95_ms"]:>9.2f} мс ({change:+.0f}%), '
+                         f'запросов {base["queries"]} -> {metrics["queries"]}{mark}')
+    return lines, regressed
+
+
+def format_results(results):
+    lines = [f'{"Размер":>9} {"Сценарий":<48} {"p50, мс":>9} {"p95, мс":>9} {"SQL":>6} {"Пик, КиБ":>10}']
+    for size, scenario_results in results.items():
+        for name, metrics in scenario_results.items():
+            lines.append(f'{size:>9} {name:<48} {metrics["p50_ms"]:>9.2f} {metrics["p95_ms"]:>9.2f} '
+                         f'{metrics["queries"]:>6} {metrics["peak_kib"]:>10.1f}')
+    return lines
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
@@ -1,11 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, jsonify
 from flask_login import login_required, current_user
-from werkzeug.security import generate_password_hash
-from models import db, Client, Role, User, Invitation, PasswordResetToken, Gateway, Terminal, ExportContract, Log
+from sqlalchemy import select, union, func
+from sqlalchemy.orm import joinedload
+from models import db, Client, Role, User, Invitation, PasswordResetToken, Gateway, Terminal, ExportContract, Log, LogChange, EmailOutbox, SlowQuery
 from forms import UserForm, ClientForm, InvitationForm, GatewayForm, TerminalForm, ExportContractForm
-from utils import send_reset_email
-from datetime import datetime
-import json
+from utils import send_reset_email, parse_date, created_between
+from mailer import wake_worker
+from exporter import log_statement, export_response, LOG_COLUMNS
+from pagination import KeysetPagination
+from cache import bump_version
+from audit import AUDITED_MODELS
+from archive import archived_record_logs
+from security import hash_password
+from responses import stream_page
+from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -29,7 +37,7 @@ def admin_user_new():
         user = User(
             username=form.username.data,
             email=form.email.data,
-            password_hash=generate_password_hash(form.password.data),
+            password_hash=hash_password(form.password.data),
             role_id=form.role_id.data,
             client_id=form.client_id.data if form.client_id.data != 0 else None,
             is_active=form.is_active.data
@@ -58,7 +66,9 @@ def admin_user_edit(user_id):
         user.client_id = form.client_id.data if form.client_id.data != 0 else None
         user.is_active = form.is_active.data
         if form.password.data:
-            user.password_hash = generate_password_hash(form.password.data)
+            user.password_hash = hash_password(form.password.data)
+        # Сбрасываем закэшированные данные пользователей во всех процессах
+        bump_version('users')
         db.session.commit()
         flash('Пользователь успешно обновлен.', 'success')
         return redirect(url_for('admin.admin_users'))
@@ -80,10 +90,8 @@ def admin_user_reset_password(user_id):
     token = PasswordResetToken(user_id=user.user_id)
     db.session.add(token)
     db.session.commit()
-    if send_reset_email(user.email, token.token):
-        flash(f'Ссылка для сброса пароля отправлена на {user.email}.', 'success')
-    else:
-        flash('Ошибка при отправке email. Пожалуйста, попробуйте позже.', 'error')
+    send_reset_email(user.email, token.token)
+    flash(f'Письмо со ссылкой для сброса пароля на {user.email} поставлено в очередь отправки.', 'success')
     return redirect(url_for('admin.admin_users'))
 
 @admin_bp.route('/clients')
@@ -92,8 +100,8 @@ def admin_clients():
     if not current_user.is_admin():
         flash('Доступ запрещен: требуется роль администратора.', 'error')
         return redirect(url_for('main.home'))
-    clients = Client.query.all()
-    return render_template('admin/clients.html', clients=clients)
+    # Запрос выполняется в шаблоне, только если строки таблицы не взяты из кэша фрагментов
+    return render_template('admin/clients.html', clients=Client.query)
 
 @admin_bp.route('/client/new', methods=['GET', 'POST'])
 @login_required
@@ -108,6 +116,7 @@ def admin_client_new():
             description=form.description.data
         )
         db.session.add(client)
+        bump_version('clients')
         db.session.commit()
         flash('Клиент успешно создан.', 'success')
         return redirect(url_for('admin.admin_clients'))
@@ -128,6 +137,7 @@ def admin_client_edit(client_id):
     if form.validate_on_submit():
         client.name = form.name.data
         client.description = form.description.data
+        bump_version('clients')
         db.session.commit()
         flash('Клиент успешно обновлен.', 'success')
         return redirect(url_for('admin.admin_clients'))
@@ -182,8 +192,7 @@ def admin_gateways():
     if not current_user.is_admin():
         flash('Доступ запрещен: требуется роль администратора.', 'error')
         return redirect(url_for('main.home'))
-    gateways = Gateway.query.all()
-    return render_template('admin/gateways.html', gateways=gateways)
+    return render_template('admin/gateways.html', gateways=Gateway.query)
 
 @admin_bp.route('/gateway/new', methods=['GET', 'POST'])
 @login_required
@@ -198,6 +207,7 @@ def admin_gateway_new():
             description=form.description.data
         )
         db.session.add(gateway)
+        bump_version('gateways')
         db.session.commit()
         flash('Шлюз успешно создан.', 'success')
         return redirect(url_for('admin.admin_gateways'))
@@ -218,6 +228,7 @@ def admin_gateway_edit(gateway_id):
     if form.validate_on_submit():
         gateway.name = form.name.data
         gateway.description = form.description.data
+        bump_version('gateways')
         db.session.commit()
         flash('Шлюз успешно обновлен.', 'success')
         return redirect(url_for('admin.admin_gateways'))
@@ -229,8 +240,7 @@ def admin_terminals():
     if not current_user.is_admin():
         flash('Доступ запрещен: требуется роль администратора.', 'error')
         return redirect(url_for('main.home'))
-    terminals = Terminal.query.all()
-    return render_template('admin/terminals.html', terminals=terminals)
+    return render_template('admin/terminals.html', terminals=Terminal.query)
 
 @admin_bp.route('/terminal/new', methods=['GET', 'POST'])
 @login_required
@@ -244,6 +254,7 @@ def admin_terminal_new():
             name=form.name.data
         )
         db.session.add(terminal)
+        bump_version('terminals')
         db.session.commit()
         flash('Терминал успешно создан.', 'success')
         return redirect(url_for('admin.admin_terminals'))
@@ -263,6 +274,7 @@ def admin_terminal_edit(terminal_id):
     form.terminal = terminal
     if form.validate_on_submit():
         terminal.name = form.name.data
+        bump_version('terminals')
         db.session.commit()
         flash('Терминал успешно обновлен.', 'success')
         return redirect(url_for('admin.admin_terminals'))
@@ -279,8 +291,9 @@ def admin_export_contracts():
     if per_page not in [10, 25, 50]:
         per_page = 10
     session['per_page'] = per_page
-    page = request.args.get('page', 1, type=int)
-    pagination = ExportContract.query.paginate(page=page, per_page=per_page, error_out=False)
+    cursor = request.args.get('cursor')
+    query = ExportContract.query.options(joinedload(ExportContract.client), joinedload(ExportContract.creator))
+    pagination = KeysetPagination(query, [ExportContract.export_contract_id], per_page, cursor=cursor, descending=False, count_key='export_contracts')
     contracts = pagination.items
     return render_template('admin/export_contracts.html', contracts=contracts, pagination=pagination, per_page=per_page)
 
@@ -299,20 +312,8 @@ def admin_export_contract_new():
             created_by=current_user.user_id
         )
         db.session.add(contract)
-        db.session.flush()  # Получаем ID записи до коммита
-        # Логируем создание
-        log = Log(
-            user_id=current_user.user_id,
-            action='create',
-            table_name='export_contracts',
-            record_id=contract.export_contract_id,
-            details=json.dumps({
-                'number': contract.number,
-                'date': str(contract.date),
-                'client_id': contract.client_id
-            }, ensure_ascii=False)
-        )
-        db.session.add(log)
+        # Запись в журнал изменений делает audit.py
+        bump_version('export_contracts')
         db.session.commit()
         flash('Экспортный контракт успешно создан.', 'success')
         return redirect(url_for('admin.admin_export_contracts'))
@@ -331,33 +332,12 @@ def admin_export_contract_edit(export_contract_id):
     form = ExportContractForm(obj=contract)
     form.export_contract = contract
     if form.validate_on_submit():
-        # Сохраняем старые значения для лога
-        old_values = {
-            'number': contract.number,
-            'date': str(contract.date),
-            'client_id': contract.client_id
-        }
         # Обновляем контракт
         contract.number = form.number.data
         contract.date = form.date.data
         contract.client_id = form.client_id.data
-        # Логируем обновление
-        new_values = {
-            'number': contract.number,
-            'date': str(contract.date),
-            'client_id': contract.client_id
-        }
-        log = Log(
-            user_id=current_user.user_id,
-            action='update',
-            table_name='export_contracts',
-            record_id=contract.export_contract_id,
-            details=json.dumps({
-                'old': old_values,
-                'new': new_values
-            }, ensure_ascii=False)
-        )
-        db.session.add(log)
+        # Запись в журнал изменений делает audit.py
+        bump_version('export_contracts')
         db.session.commit()
         flash('Контракт успешно обновлен.', 'success')
         return redirect(url_for('admin.admin_export_contracts'))
@@ -376,24 +356,101 @@ def admin_export_contract_delete(export_contract_id):
     if contract.general_data_entries:
         flash('Контракт не может быть удалён, так как с ним связаны записи в general_data.', 'error')
         return redirect(url_for('admin.admin_export_contracts'))
-    # Логируем удаление
-    log = Log(
-        user_id=current_user.user_id,
-        action='delete',
-        table_name='export_contracts',
-        record_id=contract.export_contract_id,
-        details=json.dumps({
-            'number': contract.number,
-            'date': str(contract.date),
-            'client_id': contract.client_id
-        }, ensure_ascii=False)
-    )
-    db.session.add(log)
+    # Запись в журнал изменений делает audit.py
     db.session.delete(contract)
+    bump_version('export_contracts')
     db.session.commit()
     flash('Контракт успешно удалён.', 'success')
     return redirect(url_for('admin.admin_export_contracts'))
 
+@admin_bp.route('/emails')
+@login_required
+def admin_emails():
+    if not current_user.is_admin():
+        flash('Доступ запрещен: требуется роль администратора.', 'error')
+        return redirect(url_for('main.home'))
+    # Получаем per_page из запроса или сессии, по умолчанию 10
+    per_page = request.args.get('per_page', session.get('per_page', 10), type=int)
+    if per_page not in [10, 25, 50]:
+        per_page = 10
+    session['per_page'] = per_page
+    cursor = request.args.get('cursor')
+    pagination = KeysetPagination(EmailOutbox.query, [EmailOutbox.email_id], per_page, cursor=cursor)
+    return render_template('admin/emails.html', emails=pagination.items, pagination=pagination, per_page=per_page)
+
+@admin_bp.route('/email/<int:email_id>/retry', methods=['POST'])
+@login_required
+def admin_email_retry(email_id):
+    if not current_user.is_admin():
+        flash('Доступ запрещен: требуется роль администратора.', 'error')
+        return redirect(url_for('main.home'))
+    email = db.session.get(EmailOutbox, email_id)
+    if not email:
+        flash('Письмо не найдено.', 'error')
+        return redirect(url_for('admin.admin_emails'))
+    if email.status != 'failed':
+        flash('Повторно отправить можно только письмо с ошибкой.', 'error')
+        return redirect(url_for('admin.admin_emails'))
+    email.status = 'pending'
+    email.attempts = 0
+    email.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    wake_worker()
+    flash('Письмо снова поставлено в очередь.', 'success')
+    return redirect(url_for('admin.admin_emails'))
+
+# Параметры поиска по журналу, которые переносятся в ссылки пагинации и выгрузки
+LOG_FILTER_ARGS = ['user', 'table', 'action', 'field', 'value', 'match', 'changed_only', 'date_from', 'date_to']
+
+def _log_filters():
+    # Условия поиска по журналу из параметров запроса. Возвращает (условия, параметры) или (None, параметры) при ошибке.
+    filters = {name: request.args.get(name, '').strip() for name in LOG_FILTER_ARGS}
+    filters = {name: value for name, value in filters.items() if value}
+    date_from = parse_date(filters.get('date_from'))
+    date_to = parse_date(filters.get('date_to'))
+    if ('date_from' in filters and not date_from) or ('date_to' in filters and not date_to):
+        return None, filters
+    conditions = created_between(Log.created_at, date_from, date_to)
+    if 'user' in filters:
+        user_id = db.session.execute(select(User.user_id).where(User.username == filters['user'])).scalar()
+        conditions.append(Log.user_id == user_id)
+    if 'table' in filters:
+        conditions.append(Log.table_name == filters['table'])
+    if 'action' in filters:
+        conditions.append(Log.action == filters['action'])
+    if 'field' in filters:
+        # Поиск по полю и значению идёт по индексам log_changes, без разбора JSON
+        base = [LogChange.field == filters['field']]
+        if 'changed_only' in filters:
+            base.append(LogChange.changed.is_(True))
+        value = filters.get('value')
+        match = filters.get('match', 'any')
+        if value is None:
+            change = select(LogChange.log_id).where(*base)
+        elif match == 'new':
+            change = select(LogChange.log_id).where(*base, LogChange.new_value == value)
+        elif match == 'old':
+            change = select(LogChange.log_id).where(*base, LogChange.old_value == value)
+        else:
+            # UNION вместо OR, чтобы каждая половина шла по своему индексу
+            change = union(
+                select(LogChange.log_id).where(*base, LogChange.new_value == value),
+                select(LogChange.log_id).where(*base, LogChange.old_value == value)
+            )
+        conditions.append(Log.log_id.in_(change))
+    return conditions, filters
+
+def _log_to_dict(log):
+    return {
+        'log_id': log.log_id,
+        'user': log.user.username if log.user else None,
+        'action': log.action,
+        'table_name': log.table_name,
+        'record_id': log.record_id,
+        'details': log.details,
+        'created_at': log.created_at.isoformat() if log.created_at else None
+    }
+
 @admin_bp.route('/logs')
 @login_required
 def admin_logs():
@@ -405,10 +462,69 @@ def admin_logs():
     if per_page not in [10, 25, 50]:
         per_page = 10
     session['per_page'] = per_page
-    page = request.args.get('page', 1, type=int)
-    pagination = Log.query.order_by(Log.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    cursor = request.args.get('cursor')
+    conditions, filters = _log_filters()
+    if conditions is None:
+        flash('Некорректная дата в фильтре.', 'error')
+        return redirect(url_for('admin.admin_logs'))
+    # log_id растёт вместе с created_at, поэтому листаем по первичному ключу.
+    # Общее количество считаем (с кэшем) только без фильтров.
+    query = Log.query.options(joinedload(Log.user)).filter(*conditions)
+    pagination = KeysetPagination(query, [Log.log_id], per_page, cursor=cursor, count_key=None if filters else 'logs')
     logs = pagination.items
-    return render_template('admin/logs.html', logs=logs, pagination=pagination, per_page=per_page)
+    if request.args.get('format') == 'json':
+        return jsonify({
+            'items': [_log_to_dict(log) for log in logs],
+            'next_cursor': pagination.next_cursor,
+            'prev_cursor': pagination.prev_cursor,
+            'total': pagination.total
+        })
+    fields = sorted({field for _, model_fields in AUDITED_MODELS.values() for field in model_fields})
+    return stream_page('admin/logs.html', logs=logs, pagination=pagination, per_page=per_page, filters=filters, fields=fields)
+
+@admin_bp.route('/slow_queries')
+@login_required
+def admin_slow_queries():
+    if not current_user.is_admin():
+        flash('Доступ запрещен: требуется роль администратора.', 'error')
+        return redirect(url_for('main.home'))
+    days = request.args.get('days', 7, type=int)
+    if days not in [1, 7, 30]:
+        days = 7
+    since = datetime.utcnow() - timedelta(days=days)
+    # Запросы группируются по отпечатку и сортируются по суммарному времени: сначала то, что сильнее всего нагружает базу
+    total = func.sum(SlowQuery.duration_ms)
+    queries = db.session.execute(
+        select(SlowQuery.fingerprint, func.count().label('count'), func.avg(SlowQuery.duration_ms).label('avg_ms'),
+               func.max(SlowQuery.duration_ms).label('max_ms'), total.label('total_ms'),
+               func.max(SlowQuery.created_at).label('last_seen'), func.max(SlowQuery.statement).label('statement'),
+               func.group_concat(SlowQuery.endpoint.distinct()).label('endpoints'))
+        .where(SlowQuery.created_at >= since)
+        .group_by(SlowQuery.fingerprint).order_by(total.desc()).limit(100)
+    ).all()
+    # Последний снятый план каждого отпечатка (план снимается не для каждой записи)
+    plans = {}
+    if queries:
+        rows = db.session.execute(
+            select(SlowQuery.fingerprint, SlowQuery.plan)
+            .where(SlowQuery.fingerprint.in_([query.fingerprint for query in queries]), SlowQuery.plan.is_not(None))
+            .order_by(SlowQuery.created_at)
+        )
+        plans = {row.fingerprint: row.plan for row in rows}
+    return render_template('admin/slow_queries.html', queries=queries, plans=plans, days=days)
+
+@admin_bp.route('/logs/export')
+@login_required
+def admin_logs_export():
+    if not current_user.is_admin():
+        flash('Доступ запрещен: требуется роль администратора.', 'error')
+        return redirect(url_for('main.home'))
+    export_format = request.args.get('format', 'csv')
+    conditions, filters = _log_filters()
+    if export_format not in ['csv', 'json'] or conditions is None:
+        flash('Некорректные параметры выгрузки.', 'error')
+        return redirect(url_for('admin.admin_logs'))
+    return export_response(log_statement(conditions), LOG_COLUMNS, export_format, 'logs')
 
 @admin_bp.route('/logs/record/<table_name>/<int:record_id>')
 @login_required
@@ -424,7 +540,10 @@ def admin_record_logs(table_name, record_id):
     if per_page not in [10, 25, 50]:
         per_page = 10
     session['per_page'] = per_page
-    page = request.args.get('page', 1, type=int)
-    pagination = Log.query.filter_by(table_name=table_name, record_id=record_id).order_by(Log.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+    cursor = request.args.get('cursor')
+    query = Log.query.options(joinedload(Log.user)).filter_by(table_name=table_name, record_id=record_id)
+    pagination = KeysetPagination(query, [Log.log_id], per_page, cursor=cursor)
     logs = pagination.items
-    return render_template('admin/logs.html', logs=logs, pagination=pagination, per_page=per_page, table_name=table_name, record_id=record_id)
\ No newline at end of file
+    # Архивная история читается только по запросу, чтобы не открывать файл архива на каждый просмотр
+    archived_logs = archived_record_logs(table_name, record_id) if request.args.get('archived') else None
+    return stream_page('admin/logs.html', logs=logs, pagination=pagination, per_page=per_page, table_name=table_name, record_id=record_id, archived_logs=archived_logs)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import hashlib
+from flask import Blueprint, request, jsonify, abort, make_response
+from flask_login import current_user
+from sqlalchemy.orm import load_only
+from werkzeug.http import is_resource_modified
+from models import db, GeneralData, ExportContract
+from cache import get_reference, get_version, get_updated_at
+from pagination import KeysetPagination
+from dashboard import dashboard_days, shipment_summary
+from blueprints.general import general_data_filters, is_restricted
+
+api_bp = Blueprint('api', __name__)
+
+# JSON API v1. Авторизация - та же сессия Flask-Login, права - как в blueprint general.
+#
+# Ответы на GET снабжаются ETag и Last-Modified, вычисленными по версиям данных (таблица data_versions),
+# поэтому повторный запрос с If-None-Match / If-Modified-Since получает 304 без обращения к самим данным.
+# Списки: ?fields=id,invoice_number - выбор полей, ?per_page= (до API_MAX_PER_PAGE), ?cursor= - следующая страница.
+
+API_DEFAULT_PER_PAGE = 50
+API_MAX_PER_PAGE = 500
+
+GENERAL_DATA_FIELDS = ('id', 'client_id', 'user_id', 'gateway_id', 'terminal_id', 'export_contract_id',
+                       'vehicle', 'invoice_number', 'delivery_address', 'created_at')
+EXPORT_CONTRACT_FIELDS = ('export_contract_id', 'number', 'date', 'client_id', 'created_by', 'created_at')
+
+
+def _error(message, status):
+    return make_response(jsonify({'error': message}), status)
+
+
+@api_bp.before_request
+def _require_login():
+    # Для API вместо перенаправления на страницу входа - 401
+    if not current_user.is_authenticated:
+        return _error('Требуется авторизация.', 401)
+
+
+def _scope():
+    return current_user.client_id if is_restricted(current_user) else None
+
+
+def _conditional(versions, build):
+    # versions - имена данных, от которых зависит ответ. ETag учитывает также запрос и область видимости
+    # пользователя; ответ строится вызовом build() только если клиент не прислал актуальный ETag.
+    key = repr(([(name, get_version(name)) for name in versions], _scope(), request.full_path))
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    updated = [get_updated_at(name) for name in versions]
+    last_modified = max(updated) if None not in updated else None
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(jsonify(build()))
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Браузер и прокси каждый раз проверяют актуальность, но могут использовать сохранённый ответ
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _fields(allowed):
+    requested = request.args.get('fields')
+    if not requested:
+        return allowed
+    fields = tuple(field.strip() for field in requested.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        abort(_error(f'Неизвестные поля: {", ".join(unknown)}.', 400))
+    return fields
+
+
+def _per_page():
+    per_page = request.args.get('per_page', API_DEFAULT_PER_PAGE, type=int)
+    return min(max(per_page, 1), API_MAX_PER_PAGE)
+
+
+def _serialize(obj, fields):
+    item = {}
+    for field in fields:
+        value = getattr(obj, field)
+        item[field] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return item
+
+
+def _page(query, columns, fields):
+    pagination = KeysetPagination(query, columns, _per_page(), cursor=request.args.get('cursor'), descending=False)
+    return {
+        'items': [_serialize(obj, fields) for obj in pagination.items],
+        'next_cursor': pagination.next_cursor,
+        'prev_cursor': pagination.prev_cursor,
+    }
+
+
+@api_bp.route('/general_data')
+def general_data_list():
+    fields = _fields(GENERAL_DATA_FIELDS)
+    conditions, _, error = general_data_filters(request.args)
+    if conditions is None:
+        return _error(error, 400)
+
+    def build():
+        # Загружаются только запрошенные столбцы (и id для курсора)
+        columns = [getattr(GeneralData, field) for field in fields]
+        query = GeneralData.query.options(load_only(GeneralData.id, *columns)).filter(*conditions)
+        if _scope() is not None:
+            query = query.filter_by(client_id=_scope())
+        return _page(query, [GeneralData.id], fields)
+
+    return _conditional(['general_data'], build)
+
+
+@api_bp.route('/general_data/<int:id>')
+def general_data_detail(id):
+    fields = _fields(GENERAL_DATA_FIELDS)
+
+    def build():
+        entry = db.session.get(GeneralData, id)
+        # Чужие записи для пользователя с client_id не отличаются от несуществующих
+        if entry is None or (_scope() is not None and entry.client_id != _scope()):
+            abort(_error('Запись не найдена.', 404))
+        return _serialize(entry, fields)
+
+    return _conditional(['general_data'], build)
+
+
+@api_bp.route('/export_contracts')
+def export_contract_list():
+    fields = _fields(EXPORT_CONTRACT_FIELDS)
+
+    def build():
+        query = ExportContract.query
+        if _scope() is not None:
+            query = query.filter_by(client_id=_scope())
+        return _page(query, [ExportContract.export_contract_id], fields)
+
+    return _conditional(['export_contracts'], build)
+
+
+@api_bp.route('/export_contracts/<int:export_contract_id>')
+def export_contract_detail(export_contract_id):
+    fields = _fields(EXPORT_CONTRACT_FIELDS)
+
+    def build():
+        contract = db.session.get(ExportContract, export_contract_id)
+        if contract is None or (_scope() is not None and contract.client_id != _scope()):
+            abort(_error('Экспортный контракт не найден.', 404))
+        return _serialize(contract, fields)
+
+    return _conditional(['export_contracts'], build)
+
+
+# Справочники отдаются целиком из кэша (см. cache.py): имя -> (ключ id, поля кортежа)
+REFERENCES = {
+    'clients': ('client_id', ('client_id', 'name')),
+    'gateways': ('gateway_id', ('gateway_id', 'name')),
+    'terminals': ('terminal_id', ('terminal_id', 'name')),
+}
+
+
+@api_bp.route('/<any(clients, gateways, terminals):name>')
+def reference_list(name):
+    key, fields = REFERENCES[name]
+
+    def build():
+        items = [dict(zip(fields, row)) for row in get_reference(name)]
+        if name == 'clients' and _scope() is not None:
+            # Пользователь с client_id видит только своего клиента, как в GeneralDataForm
+            items = [item for item in items if item[key] == _scope()]
+        return {'items': items}
+
+    return _conditional([name], build)
+
+
+@api_bp.route('/dashboard')
+def dashboard():
+    # Сводка отгрузок по дням, клиентам, шлюзам и терминалам за ?days= дней (см. dashboard.py)
+    days = dashboard_days(request.args.get('days', type=int))
+
+    def build():
+        summary = shipment_summary(days, _scope())
+        return {
+            'days': days,
+            'since': summary['since'].isoformat(),
+            'total': summary['total'],
+            'by_day': [{'day': day.isoformat(), 'shipments': count} for day, count in summary['days']],
+            'by_client': [{'client_id': key, 'name': name, 'shipments': count} for key, name, count in summary['clients']],
+            'by_gateway': [{'gateway_id': key, 'name': name, 'shipments': count} for key, name, count in summary['gateways']],
+            'by_terminal': [{'terminal_id': key, 'name': name, 'shipments': count} for key, name, count in summary['terminals']],
+        }
+
+    # Имена в сводке берутся из справочников, поэтому ETag зависит и от их версий
+    return _conditional(['general_data', 'clients', 'gateways', 'terminals'], build)
@@ -1,9 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, flash
 from flask_login import login_user, logout_user, current_user, login_required
-from werkzeug.security import generate_password_hash, check_password_hash
 from models import db, User, Invitation, PasswordResetToken
 from forms import LoginForm, ForgotPasswordForm, ResetPasswordForm, RegisterForm
 from utils import send_reset_email
+from security import hash_password, verify_password, needs_rehash, throttle
+from cache import bump_version
 from datetime import datetime
 
 auth_bp = Blueprint('auth', __name__)
@@ -15,11 +16,20 @@ def login():
         return redirect(url_for('main.home'))
     form = LoginForm()
     if form.validate_on_submit():
+        # Лимит попыток проверяется до хэширования пароля
+        if not throttle('login', form.email.data):
+            flash('Слишком много попыток входа. Повторите позже.', 'error')
+            return render_template('login.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
-        if user and check_password_hash(user.password_hash, form.password.data):
+        if user and verify_password(user.password_hash, form.password.data):
             if not user.is_active:
                 flash('Ваш аккаунт неактивен. Обратитесь к администратору.', 'error')
                 return redirect(url_for('auth.login'))
+            # Пароль пересчитывается, если изменились параметры хэширования
+            if needs_rehash(user.password_hash):
+                user.password_hash = hash_password(form.password.data)
+                bump_version('users')
+                db.session.commit()
             login_user(user)
             flash('Вход выполнен успешно.', 'success')
             return redirect(url_for('main.home'))
@@ -33,6 +43,9 @@ def forgot_password():
         return redirect(url_for('main.home'))
     form = ForgotPasswordForm()
     if form.validate_on_submit():
+        if not throttle('forgot_password', form.email.data):
+            flash('Слишком много запросов на сброс пароля. Повторите позже.', 'error')
+            return render_template('forgot_password.html', form=form), 429
         user = User.query.filter_by(email=form.email.data).first()
         if user:
             if not user.is_active:
@@ -41,10 +54,8 @@ def forgot_password():
             token = PasswordResetToken(user_id=user.user_id)
             db.session.add(token)
             db.session.commit()
-            if send_reset_email(user.email, token.token):
-                flash('Ссылка для сброса пароля отправлена на ваш email.', 'success')
-            else:
-                flash('Ошибка при отправке email. Пожалуйста, попробуйте позже.', 'error')
+            send_reset_email(user.email, token.token)
+            flash('Ссылка для сброса пароля будет отправлена на ваш email в течение нескольких минут.', 'success')
         else:
             flash('Пользователь с таким email не найден.', 'error')
         return redirect(url_for('auth.forgot_password'))
@@ -63,8 +74,9 @@ def reset_password(token):
     form = ResetPasswordForm()
     if form.validate_on_submit():
         user = db.session.get(User, reset_token.user_id)
-        user.password_hash = generate_password_hash(form.password.data)
+        user.password_hash = hash_password(form.password.data)
         db.session.delete(reset_token)
+        bump_version('users')
         db.session.commit()
         flash('Пароль успешно изменён. Пожалуйста, войдите.', 'success')
         return redirect(url_for('auth.login'))
@@ -87,7 +99,7 @@ def register(token):
         user = User(
             username=form.username.data,
             email=form.email.data,
-            password_hash=generate_password_hash(form.password.data),
+            password_hash=hash_password(form.password.data),
             role_id=invitation.role_id,
             client_id=invitation.client_id,
             is_active=True
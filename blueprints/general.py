@@ -1,11 +1,69 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app
 from flask_login import login_required, current_user
-from models import db, GeneralData, ExportContract, Log
-from forms import GeneralDataForm
-import json
+from sqlalchemy import select, func, literal_column
+from sqlalchemy.orm import joinedload, contains_eager
+from models import db, GeneralData, Client, User, Gateway, Terminal, ExportContract
+from forms import GeneralDataForm, GeneralDataImportForm, GeneralDataBulkForm
+from importer import read_rows, validate_rows, import_rows
+from exporter import general_data_statement, export_response, GENERAL_DATA_COLUMNS
+from bulk import bulk_update, bulk_delete
+from utils import parse_date, created_between, fts_query, search_general_data
+from cache import get_choices, get_contract_choices
+from pagination import KeysetPagination
+from responses import stream_page
 
 general_bp = Blueprint('general', __name__, template_folder='templates/general')
 
+# Сортировка списка: параметр sort -> (столбцы перед id, связь для JOIN).
+# Внутри одного значения справочника записи идут по created_at - этот порядок дают индексы
+# ix_general_data_<fk>_created_at_id. Пустые vehicle/delivery_address сортируются как '',
+# чтобы ключ постраничного вывода не содержал NULL; те же выражения используются в индексах.
+SORT_COLUMNS = {
+    'id': ([], None),
+    'created_at': ([GeneralData.created_at], None),
+    'client': ([Client.name, GeneralData.created_at], GeneralData.client),
+    'user': ([User.username, GeneralData.created_at], GeneralData.user),
+    'gateway': ([Gateway.name, GeneralData.created_at], GeneralData.gateway),
+    'terminal': ([Terminal.name, GeneralData.created_at], GeneralData.terminal),
+    'export_contract': ([ExportContract.number, GeneralData.created_at], GeneralData.export_contract),
+    'vehicle': ([func.coalesce(GeneralData.vehicle, literal_column("''"))], None),
+    'invoice_number': ([GeneralData.invoice_number], None),
+    'delivery_address': ([func.coalesce(GeneralData.delivery_address, literal_column("''"))], None),
+}
+
+INDEX_FILTER_ARGS = ['q', 'client_id', 'gateway_id', 'terminal_id', 'export_contract_id', 'user', 'date_from', 'date_to']
+
+def general_data_filters(args):
+    # Условия фильтра general_data из параметров запроса (используется и в API).
+    # Возвращает (условия, параметры, None) или (None, параметры, текст ошибки).
+    filters = {name: args.get(name, '').strip() for name in INDEX_FILTER_ARGS}
+    filters = {name: value for name, value in filters.items() if value and value != '0'}
+    date_from = parse_date(filters.get('date_from'))
+    date_to = parse_date(filters.get('date_to'))
+    if ('date_from' in filters and not date_from) or ('date_to' in filters and not date_to):
+        return None, filters, 'Некорректная дата в фильтре.'
+    conditions = created_between(GeneralData.created_at, date_from, date_to)
+    for name, column in (('client_id', GeneralData.client_id), ('gateway_id', GeneralData.gateway_id),
+                         ('terminal_id', GeneralData.terminal_id), ('export_contract_id', GeneralData.export_contract_id)):
+        if name in filters:
+            if not filters[name].isdigit():
+                return None, filters, 'Некорректный фильтр.'
+            conditions.append(column == int(filters[name]))
+    if 'user' in filters:
+        user_id = db.session.execute(select(User.user_id).where(User.username == filters['user'])).scalar()
+        conditions.append(GeneralData.user_id == user_id)
+    if 'q' in filters:
+        # Поиск по № инвойса, транспортному средству и адресу доставки через индекс general_data_fts
+        search = fts_query(filters['q'])
+        if search is None:
+            return None, filters, 'Для поиска введите не менее 3 символов.'
+        conditions.append(search_general_data(GeneralData.id, search))
+    return conditions, filters, None
+
+def is_restricted(user):
+    # Пользователи с client_id (кроме администраторов) работают только с записями своего клиента
+    return not user.is_admin() and user.client_id is not None
+
 @general_bp.route('/general')
 @login_required
 def index():
@@ -15,24 +73,70 @@ def index():
     if per_page not in [10, 25, 50]:
         per_page = 10
     session['per_page'] = per_page
-    page = request.args.get('page', 1, type=int)
-    if current_user.is_admin() or current_user.client_id is None:
+    cursor = request.args.get('cursor')
+    sort = request.args.get('sort', 'created_at')
+    if sort not in SORT_COLUMNS:
+        sort = 'created_at'
+    order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+    conditions, filters, error = general_data_filters(request.args)
+    if conditions is None:
+        flash(error, 'error')
+        return redirect(url_for('general.index', per_page=per_page))
+    sort_columns, sort_relation = SORT_COLUMNS[sort]
+    # Подгружаем связанные справочники одним запросом, чтобы шаблон не делал N+1 SELECT;
+    # справочник, по которому идёт сортировка, присоединяется явно и заполняет связь из того же JOIN
+    relations = [GeneralData.client, GeneralData.user, GeneralData.gateway, GeneralData.terminal, GeneralData.export_contract]
+    query = GeneralData.query.options(*[
+        contains_eager(relation) if relation is sort_relation else joinedload(relation) for relation in relations
+    ])
+    if sort_relation is not None:
+        query = query.join(sort_relation)
+    restricted = is_restricted(current_user)
+    if not restricted:
         # Администраторы и пользователи без client_id видят все записи
-        pagination = GeneralData.query.paginate(page=page, per_page=per_page, error_out=False)
+        count_key = 'general_data'
     else:
         # Пользователи с client_id видят только свои записи
-        pagination = GeneralData.query.filter_by(client_id=current_user.client_id).paginate(page=page, per_page=per_page, error_out=False)
+        query = query.filter_by(client_id=current_user.client_id)
+        count_key = f'general_data:client={current_user.client_id}'
+    query = query.filter(*conditions)
+    # Количество записей считаем (с кэшем) только без фильтров
+    pagination = KeysetPagination(query, sort_columns + [GeneralData.id], per_page, cursor=cursor, descending=order == 'desc',
+                                  count_key=None if filters else count_key)
     entries = pagination.items
-    return render_template('general/index.html', entries=entries, pagination=pagination, per_page=per_page)
+    return stream_page(
+        'general/index.html', entries=entries, pagination=pagination, per_page=per_page,
+        filters=filters, sort=sort, order=order, bulk_form=GeneralDataBulkForm(),
+        # Пользователи с client_id не выбирают клиента, а контракты видят только свои
+        clients=[] if restricted else get_choices('clients'),
+        gateways=get_choices('gateways'), terminals=get_choices('terminals'),
+        contracts=get_contract_choices(current_user.client_id if restricted else None)
+    )
+
+@general_bp.route('/general/export')
+@login_required
+def export_entries():
+    export_format = request.args.get('format', 'csv')
+    date_from = parse_date(request.args.get('date_from'))
+    date_to = parse_date(request.args.get('date_to'))
+    if export_format not in ['csv', 'json'] or (request.args.get('date_from') and not date_from) or (request.args.get('date_to') and not date_to):
+        flash('Некорректные параметры выгрузки.', 'error')
+        return redirect(url_for('general.index'))
+    conditions = created_between(GeneralData.created_at, date_from, date_to)
+    if current_user.is_admin() or current_user.client_id is None:
+        client_id = request.args.get('client_id', 0, type=int)
+        if client_id:
+            conditions.append(GeneralData.client_id == client_id)
+    else:
+        # Пользователи с client_id выгружают только свои записи
+        conditions.append(GeneralData.client_id == current_user.client_id)
+    return export_response(general_data_statement(conditions), GENERAL_DATA_COLUMNS, export_format, 'general_data')
 
 @general_bp.route('/general/new', methods=['GET', 'POST'])
 @login_required
 def new_entry():
+    # Выбор client_id и export_contract_id для пользователей с client_id ограничивает сама форма
     form = GeneralDataForm()
-    # Ограничиваем выбор client_id для пользователей с client_id
-    if current_user.client_id is not None and not current_user.is_admin():
-        form.client_id.choices = [(current_user.client_id, current_user.client.name)]
-        form.export_contract_id.choices = [(contract.export_contract_id, contract.number) for contract in ExportContract.query.filter_by(client_id=current_user.client_id).all()]
     if form.validate_on_submit():
         entry = GeneralData(
             client_id=form.client_id.data,
@@ -45,29 +149,38 @@ def new_entry():
             user_id=current_user.user_id
         )
         db.session.add(entry)
-        db.session.flush()  # Получаем ID записи до коммита
-        # Логируем создание
-        log = Log(
-            user_id=current_user.user_id,
-            action='create',
-            table_name='general_data',
-            record_id=entry.id,
-            details=json.dumps({
-                'client_id': entry.client_id,
-                'gateway_id': entry.gateway_id,
-                'terminal_id': entry.terminal_id,
-                'export_contract_id': entry.export_contract_id,
-                'vehicle': entry.vehicle,
-                'invoice_number': entry.invoice_number,
-                'delivery_address': entry.delivery_address
-            }, ensure_ascii=False)
-        )
-        db.session.add(log)
+        # Запись в журнал изменений делает audit.py
         db.session.commit()
         flash('Запись успешно создана.', 'success')
         return redirect(url_for('general.index'))
     return render_template('general/form.html', form=form)
 
+@general_bp.route('/general/import', methods=['GET', 'POST'])
+@login_required
+def import_entries():
+    form = GeneralDataImportForm()
+    report = None
+    if form.validate_on_submit():
+        try:
+            rows = read_rows(form.file.data)
+        except Exception:
+            flash('Не удалось прочитать файл. Проверьте формат CSV/XLSX и кодировку UTF-8.', 'error')
+            return render_template('general/import.html', form=form, report=report)
+        max_rows = current_app.config.get('IMPORT_MAX_ROWS', 10000)
+        if len(rows) > max_rows:
+            flash(f'В файле больше {max_rows} строк. Разбейте его на несколько файлов.', 'error')
+            return render_template('general/import.html', form=form, report=report)
+        valid, errors, preview = validate_rows(rows, current_user)
+        report = {'total': len(rows), 'valid': len(valid), 'errors': errors, 'preview': preview}
+        # Кнопка "Проверить" - только предварительный просмотр без записи в БД
+        if not form.preview.data:
+            imported = import_rows(valid, current_user.user_id)
+            flash(f'Импортировано записей: {imported}, пропущено с ошибками: {len(errors)}.', 'success' if imported else 'error')
+            if not errors:
+                return redirect(url_for('general.index'))
+            report['imported'] = imported
+    return render_template('general/import.html', form=form, report=report)
+
 @general_bp.route('/general/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_entry(id):
@@ -79,22 +192,9 @@ def edit_entry(id):
     if not current_user.is_admin() and current_user.client_id is not None and entry.client_id != current_user.client_id:
         flash('Доступ к редактированию этой записи запрещён.', 'error')
         return redirect(url_for('general.index'))
+    # Выбор client_id и export_contract_id для пользователей с client_id ограничивает сама форма
     form = GeneralDataForm(obj=entry)
-    # Ограничиваем выбор client_id и export_contract_id для пользователей с client_id
-    if current_user.client_id is not None and not current_user.is_admin():
-        form.client_id.choices = [(current_user.client_id, current_user.client.name)]
-        form.export_contract_id.choices = [(contract.export_contract_id, contract.number) for contract in ExportContract.query.filter_by(client_id=current_user.client_id).all()]
     if form.validate_on_submit():
-        # Сохраняем старые значения для лога
-        old_values = {
-            'client_id': entry.client_id,
-            'gateway_id': entry.gateway_id,
-            'terminal_id': entry.terminal_id,
-            'export_contract_id': entry.export_contract_id,
-            'vehicle': entry.vehicle,
-            'invoice_number': entry.invoice_number,
-            'delivery_address': entry.delivery_address
-        }
         # Обновляем запись
         entry.client_id = form.client_id.data
         entry.gateway_id = form.gateway_id.data
@@ -103,27 +203,7 @@ def edit_entry(id):
         entry.vehicle = form.vehicle.data or None
         entry.invoice_number = form.invoice_number.data
         entry.delivery_address = form.delivery_address.data or None
-        # Логируем обновление
-        new_values = {
-            'client_id': entry.client_id,
-            'gateway_id': entry.gateway_id,
-            'terminal_id': entry.terminal_id,
-            'export_contract_id': entry.export_contract_id,
-            'vehicle': entry.vehicle,
-            'invoice_number': entry.invoice_number,
-            'delivery_address': entry.delivery_address
-        }
-        log = Log(
-            user_id=current_user.user_id,
-            action='update',
-            table_name='general_data',
-            record_id=entry.id,
-            details=json.dumps({
-                'old': old_values,
-                'new': new_values
-            }, ensure_ascii=False)
-        )
-        db.session.add(log)
+        # Запись в журнал изменений делает audit.py
         db.session.commit()
         flash('Запись успешно обновлена.', 'success')
         return redirect(url_for('general.index'))
@@ -140,24 +220,43 @@ def delete_entry(id):
     if not current_user.is_admin() and current_user.client_id is not None and entry.client_id != current_user.client_id:
         flash('Доступ к удалению этой записи запрещён.', 'error')
         return redirect(url_for('general.index'))
-    # Логируем удаление
-    log = Log(
-        user_id=current_user.user_id,
-        action='delete',
-        table_name='general_data',
-        record_id=entry.id,
-        details=json.dumps({
-            'client_id': entry.client_id,
-            'gateway_id': entry.gateway_id,
-            'terminal_id': entry.terminal_id,
-            'export_contract_id': entry.export_contract_id,
-            'vehicle': entry.vehicle,
-            'invoice_number': entry.invoice_number,
-            'delivery_address': entry.delivery_address
-        }, ensure_ascii=False)
-    )
-    db.session.add(log)
+    # Запись в журнал изменений делает audit.py
     db.session.delete(entry)
     db.session.commit()
     flash('Запись успешно удалена.', 'success')
-    return redirect(url_for('general.index'))
\ No newline at end of file
+    return redirect(url_for('general.index'))
+
+@general_bp.route('/general/bulk', methods=['POST'])
+@login_required
+def bulk_entries():
+    # Возврат на ту же страницу списка: фильтры, сортировка и курсор передаются в адресе формы
+    back = url_for('general.index', **request.args.to_dict())
+    form = GeneralDataBulkForm()
+    if not form.validate_on_submit():
+        flash('Некорректные параметры массовой операции.', 'error')
+        return redirect(back)
+    ids = sorted(set(request.form.getlist('ids', type=int)))
+    if not ids:
+        flash('Не выбрано ни одной записи.', 'error')
+        return redirect(back)
+    max_rows = current_app.config.get('BULK_MAX_ROWS', 1000)
+    if len(ids) > max_rows:
+        flash(f'За одну операцию можно изменить не более {max_rows} записей.', 'error')
+        return redirect(back)
+    # Пользователи с client_id изменяют и удаляют только записи своего клиента, остальные пропускаются
+    client_id = current_user.client_id if is_restricted(current_user) else None
+    if form.action.data == 'delete':
+        done = bulk_delete(ids, current_user.user_id, client_id)
+        message = f'Удалено записей: {done}'
+    else:
+        values = form.values()
+        if not values:
+            flash('Не указано ни одного изменения.', 'error')
+            return redirect(back)
+        done = bulk_update(ids, values, current_user.user_id, client_id)
+        message = f'Изменено записей: {done}'
+    skipped = len(ids) - done
+    if skipped:
+        message += f', пропущено (нет доступа, не найдены или без изменений): {skipped}'
+    flash(message + '.', 'success' if done else 'error')
+    return redirect(back)
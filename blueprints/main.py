@@ -1,7 +1,16 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, request
+from flask_login import current_user
+from dashboard import dashboard_days, shipment_summary
+from blueprints.general import is_restricted
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
 def home():
-    return render_template('home.html')
\ No newline at end of file
+    summary = None
+    days = None
+    if current_user.is_authenticated:
+        days = dashboard_days(request.args.get('days', type=int))
+        # Пользователь с client_id видит только отгрузки своего клиента
+        summary = shipment_summary(days, current_user.client_id if is_restricted(current_user) else None)
+    return render_template('home.html', summary=summary, days=days)
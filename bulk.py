@@ -0,0 +1,55 @@
+from sqlalchemy import select, update, delete, or_
+from models import db, GeneralData
+from audit import record, make_entry
+from importer import LOGGED_FIELDS
+
+# Массовое изменение и удаление записей general_data, выбранных в списке.
+#
+# Каждая операция - один UPDATE или DELETE по списку id в одной транзакции; журнал изменений пишется
+# одной пачкой через audit.record (событий ORM при массовых запросах нет). client_id - ограничение
+# пользователя с client_id: чужие записи не изменяются, как в edit_entry и delete_entry.
+
+# Поля, которые можно изменить массово
+BULK_FIELDS = ('gateway_id', 'terminal_id', 'export_contract_id', 'vehicle')
+
+_LOGGED_COLUMNS = [getattr(GeneralData, field) for field in LOGGED_FIELDS]
+
+
+def _conditions(ids, client_id):
+    conditions = [GeneralData.id.in_(ids)]
+    if client_id is not None:
+        conditions.append(GeneralData.client_id == client_id)
+    return conditions
+
+
+def _details(row):
+    return {field: getattr(row, field) for field in LOGGED_FIELDS}
+
+
+def bulk_update(ids, values, user_id, client_id=None):
+    # Возвращает число изменённых записей. Записи, где значения уже совпадают, не обновляются и не попадают в журнал.
+    conditions = _conditions(ids, client_id)
+    conditions.append(or_(*[getattr(GeneralData, field).is_not(value) for field, value in values.items()]))
+    # Старые значения для журнала читаются в той же транзакции, что и UPDATE
+    old = {row.id: _details(row) for row in db.session.execute(select(GeneralData.id, *_LOGGED_COLUMNS).where(*conditions))}
+    updated = db.session.execute(
+        update(GeneralData).where(*conditions).values(**values).returning(GeneralData.id, *_LOGGED_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    record(db.session, [
+        make_entry(user_id, 'update', 'general_data', row.id, {'old': old[row.id], 'new': _details(row)})
+        for row in updated
+    ])
+    db.session.commit()
+    return len(updated)
+
+
+def bulk_delete(ids, user_id, client_id=None):
+    # Возвращает число удалённых записей; удалённые значения для журнала возвращает сам DELETE
+    deleted = db.session.execute(
+        delete(GeneralData).where(*_conditions(ids, client_id)).returning(GeneralData.id, *_LOGGED_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).all()
+    record(db.session, [make_entry(user_id, 'delete', 'general_data', row.id, _details(row)) for row in deleted])
+    db.session.commit()
+    return len(deleted)
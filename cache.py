@@ -0,0 +1,110 @@
+import time
+from flask import g, current_app
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import joinedload
+from models import db, DataVersion, User, Client, Role, Gateway, Terminal, ExportContract
+from metrics import cache_hit, cache_miss
+
+# Загрузчики справочников для выпадающих списков
+_LOADERS = {
+    'clients': lambda: db.session.execute(select(Client.client_id, Client.name).order_by(Client.client_id)).all(),
+    'roles': lambda: db.session.execute(select(Role.role_id, Role.name).order_by(Role.role_id)).all(),
+    'gateways': lambda: db.session.execute(select(Gateway.gateway_id, Gateway.name).order_by(Gateway.gateway_id)).all(),
+    'terminals': lambda: db.session.execute(select(Terminal.terminal_id, Terminal.name).order_by(Terminal.terminal_id)).all(),
+    'export_contracts': lambda: db.session.execute(
+        select(ExportContract.export_contract_id, ExportContract.number, ExportContract.client_id).order_by(ExportContract.export_contract_id)
+    ).all(),
+}
+
+# Кэш процесса: имя справочника -> (версия, список кортежей)
+_reference_cache = {}
+
+# Кэш пользователей сессии: user_id -> (версии users/clients/roles, время загрузки, отсоединённый User)
+_principal_cache = {}
+
+
+def get_versions():
+    # Версии читаются из БД один раз за запрос, поэтому изменения видны всем процессам
+    if 'data_versions' not in g:
+        rows = db.session.execute(select(DataVersion.name, DataVersion.version, DataVersion.updated_at)).all()
+        g.data_versions = {name: version for name, version, _ in rows}
+        g.data_updated_at = {name: updated_at for name, _, updated_at in rows}
+    return g.data_versions
+
+
+def get_version(name):
+    return get_versions().get(name, 0)
+
+
+def get_updated_at(name):
+    get_versions()
+    return g.data_updated_at.get(name)
+
+
+def bump_version(name):
+    # Вызывается до commit, в той же транзакции, что и изменение данных
+    db.session.execute(
+        insert(DataVersion).values(name=name, version=1, updated_at=func.current_timestamp()).on_conflict_do_update(
+            index_elements=[DataVersion.name], set_={'version': DataVersion.version + 1, 'updated_at': func.current_timestamp()}
+        )
+    )
+    g.pop('data_versions', None)
+    g.pop('data_updated_at', None)
+
+
+def get_reference(name):
+    version = get_version(name)
+    cached = _reference_cache.get(name)
+    if cached is not None and cached[0] == version:
+        cache_hit('references')
+        return cached[1]
+    cache_miss('references')
+    rows = [tuple(row) for row in _LOADERS[name]()]
+    _reference_cache[name] = (version, rows)
+    return rows
+
+
+def warm_references():
+    # Справочники загружаются заранее (планировщиком), чтобы запрос после их изменения не ждал загрузки
+    for name in _LOADERS:
+        get_reference(name)
+    return len(_LOADERS)
+
+
+def get_choices(name):
+    return [(row[0], row[1]) for row in get_reference(name)]
+
+
+def get_contract_choices(client_id=None):
+    return [(contract_id, number) for contract_id, number, contract_client_id in get_reference('export_contracts')
+            if client_id is None or contract_client_id == client_id]
+
+
+def get_name(name, key):
+    return dict(get_choices(name)).get(key)
+
+
+def load_principal(user_id):
+    # Пользователь загружается вместе с ролью и клиентом одним запросом, чтобы is_admin(),
+    # is_manager() и current_user.client не делали отдельных SELECT. При PRINCIPAL_CACHE_TTL > 0
+    # загруженный объект переиспользуется между запросами, пока не изменятся версии users/clients/roles.
+    # Поэтому любое изменение пользователя сопровождается bump_version('users'), иначе db.session.get(User, ...)
+    # в том же запросе вернёт устаревшую копию из кэша.
+    ttl = current_app.config.get('PRINCIPAL_CACHE_TTL', 30)
+    versions = (get_version('users'), get_version('clients'), get_version('roles'))
+    cached = _principal_cache.get(user_id)
+    if ttl and cached is not None and cached[0] == versions and time.monotonic() - cached[1] < ttl:
+        cache_hit('principals')
+        return db.session.merge(cached[2], load=False)
+    cache_miss('principals')
+    user = db.session.execute(
+        select(User).options(joinedload(User.role), joinedload(User.client)).where(User.user_id == user_id)
+    ).scalar_one_or_none()
+    if user is None or not ttl:
+        _principal_cache.pop(user_id, None)
+        return user
+    # В кэше хранится отсоединённый объект, в сессию запроса попадает его копия
+    db.session.expunge(user)
+    _principal_cache[user_id] = (versions, time.monotonic(), user)
+    return db.session.merge(user, load=False)
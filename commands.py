@@ -0,0 +1,180 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db
+from database import optimize_database
+from migrations import upgrade
+from mailer import create_pool, process_outbox
+from templating import compile_templates
+from scheduler import run_due_jobs, JOBS
+from archive import archive_logs
+from dashboard import rebuild_shipment_counters
+from seed import seed_roles, create_admin
+from forms import password_error
+import bench
+
+# Команды `flask ...`. Регистрируются в create_app через register_commands(app).
+#
+# Подготовка новой или обновление существующей базы (безопасно запускать при каждой выкладке):
+#   flask init-db
+#   flask create-admin
+#   flask compile-templates
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Создаёт недостающие таблицы, применяет миграции и добавляет роли. Можно запускать повторно."""
+    db.create_all()
+    applied = upgrade()
+    for version, description in applied:
+        print(f"Применена миграция {version}: {description}")
+    added = seed_roles()
+    for name in added:
+        print(f"Добавлена роль: {name}")
+    if not applied and not added:
+        print("База данных уже в актуальном состоянии.")
+
+
+@click.command('create-admin')
+@click.option('--username', prompt='Имя пользователя', help='Имя администратора.')
+@click.option('--email', prompt='Email', help='Email администратора.')
+@click.option('--password', prompt='Пароль', hide_input=True, confirmation_prompt=True,
+              help='Пароль (если не указан, запрашивается без отображения).')
+@with_appcontext
+def create_admin_command(username, email, password):
+    """Создаёт администратора, если пользователя с таким именем и email ещё нет."""
+    error = password_error(password)
+    if error:
+        raise click.BadParameter(error, param_hint='--password')
+    admin, message = create_admin(username, email, password)
+    print(message or f"Администратор {admin.username} успешно создан.")
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Применяет к базе данных недостающие миграции схемы."""
+    applied = upgrade()
+    for version, description in applied:
+        print(f"Применена миграция {version}: {description}")
+    if not applied:
+        print("База данных уже в актуальном состоянии.")
+
+
+@click.command('send-emails')
+@with_appcontext
+def send_emails_command():
+    """Однократно отправляет письма из очереди (без фонового потока)."""
+    app = current_app._get_current_object()
+    pool = create_pool(app)
+    sent, failed = process_outbox(app, pool)
+    pool.close_idle(force=True)
+    print(f"Отправлено писем: {sent}, с ошибкой: {failed}")
+
+
+@click.command('archive-logs')
+@click.option('--days', type=int, default=None, help='Возраст записей в днях (по умолчанию LOG_RETENTION_DAYS).')
+@with_appcontext
+def archive_logs_command(days):
+    """Переносит старые записи журнала изменений в сжатый архив."""
+    moved = archive_logs(days)
+    print(f"Перенесено в архив записей журнала: {moved}")
+
+
+@click.command('optimize-db')
+@click.option('--analyze', is_flag=True, help='Полностью пересобрать статистику (ANALYZE).')
+@with_appcontext
+def optimize_db_command(analyze):
+    """Обновляет статистику планировщика запросов SQLite (PRAGMA optimize)."""
+    optimize_database(analyze)
+    print("Статистика базы данных обновлена.")
+
+
+@click.command('run-jobs')
+@click.argument('names', nargs=-1)
+@click.option('--force', is_flag=True, help='Выполнить задачи, даже если срок ещё не наступил.')
+@with_appcontext
+def run_jobs_command(names, force):
+    """Выполняет задачи обслуживания, срок которых наступил (например, из cron)."""
+    unknown = [name for name in names if name not in JOBS]
+    if unknown:
+        raise click.BadParameter(f"неизвестные задачи: {', '.join(unknown)}. Доступны: {', '.join(JOBS)}")
+    done = run_due_jobs(current_app._get_current_object(), names, force)
+    for name, result, error in done:
+        print(f"{name}: {'ошибка: ' + error if error else result}")
+    if not done:
+        print("Нет задач, срок которых наступил.")
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    """Компилирует все шаблоны в кэш байткода (запускать после выкладки)."""
+    print(f"Скомпилировано шаблонов: {compile_templates(current_app)}")
+
+
+@click.command('rebuild-counters')
+@with_appcontext
+def rebuild_counters_command():
+    """Пересчитывает счётчики отгрузок главной страницы по всем записям general_data."""
+    rows = rebuild_shipment_counters()
+    print(f"Счётчики отгрузок пересчитаны, строк сводки: {rows}")
+
+
+def _progress(done, total):
+    print(f"  {done}/{total}")
+
+
+@click.command('generate-data')
+@click.option('--clients', default=20, help='Количество клиентов.')
+@click.option('--gateways', default=10, help='Количество шлюзов.')
+@click.option('--terminals', default=30, help='Количество терминалов.')
+@click.option('--contracts', default=200, help='Количество экспортных контрактов.')
+@click.option('--rows', default=100000, help='Сколько записей general_data добавить.')
+@click.option('--logs', default=0, help='Сколько записей журнала изменений добавить.')
+@click.option('--seed', default=1, help='Начальное значение генератора случайных чисел.')
+@with_appcontext
+def generate_data_command(clients, gateways, terminals, contracts, rows, logs, seed):
+    """Заполняет базу синтетическими данными для нагрузочных замеров."""
+    bench.ensure_references(clients, gateways, terminals, contracts, seed=seed)
+    print(f"Добавлено записей general_data: {bench.generate_general_data(rows, seed=seed, progress=_progress)}")
+    if logs:
+        print(f"Добавлено записей журнала: {bench.generate_logs(logs, seed=seed, progress=_progress)}")
+
+
+@click.command('benchmark')
+@click.option('--sizes', default='10000,100000', help='Размеры general_data через запятую, по возрастанию.')
+@click.option('--per-page', default='10,50', help='Размеры страницы через запятую.')
+@click.option('--iterations', default=20, help='Повторов каждого сценария.')
+@click.option('--save', type=click.Path(dir_okay=False), help='Сохранить результаты как базовые замеры (JSON).')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Сравнить с базовыми замерами (JSON).')
+@click.option('--threshold', default=20, help='Допустимый рост p95 в процентах при сравнении.')
+@with_appcontext
+def benchmark_command(sizes, per_page, iterations, save, compare, threshold):
+    """Замеряет p50/p95, число SQL-запросов и пик памяти основных страниц. Запускать на копии базы."""
+    results = bench.run_benchmark(current_app._get_current_object(), [int(size) for size in sizes.split(',')],
+                                  [int(value) for value in per_page.split(',')], iterations, progress=_progress)
+    for line in bench.format_results(results):
+        print(line)
+    if save:
+        bench.save_results(save, results)
+        print(f"Результаты сохранены в {save}")
+    if compare:
+        lines, regressed = bench.compare(results, bench.load_baseline(compare), threshold)
+        for line in lines:
+            print(line)
+        if regressed:
+            raise SystemExit(1)
+
+
+COMMANDS = [
+    init_db_command, create_admin_command, upgrade_db_command, send_emails_command, archive_logs_command,
+    optimize_db_command, run_jobs_command, compile_templates_command, rebuild_counters_command,
+    generate_data_command, benchmark_command,
+]
+
+
+def register_commands(app):
+    for command in COMMANDS:
+        app.cli.add_command(command)
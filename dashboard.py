@@ -0,0 +1,63 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, delete, insert, func
+from models import db, GeneralData, ShipmentCounter
+from cache import get_choices, bump_version
+
+# Сводка отгрузок для главной страницы и API.
+#
+# Данные берутся из таблицы shipment_counters (день, клиент, шлюз, терминал -> число записей), которую
+# триггеры на general_data обновляют при каждом добавлении, изменении и удалении записи. Поэтому сводка
+# за период читает не больше (дней * сочетаний справочников) строк, независимо от объёма general_data.
+# Настройки: DASHBOARD_DAYS - период по умолчанию (30), DASHBOARD_MAX_DAYS - наибольший период (366).
+
+
+def dashboard_days(value):
+    days = value or current_app.config.get('DASHBOARD_DAYS', 30)
+    return min(max(days, 1), current_app.config.get('DASHBOARD_MAX_DAYS', 366))
+
+
+def shipment_summary(days, client_id=None):
+    # created_at хранится в UTC (CURRENT_TIMESTAMP), поэтому и границы периода считаются в UTC
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    query = select(ShipmentCounter.day, ShipmentCounter.client_id, ShipmentCounter.gateway_id,
+                   ShipmentCounter.terminal_id, ShipmentCounter.shipments).where(ShipmentCounter.day >= since)
+    if client_id is not None:
+        query = query.where(ShipmentCounter.client_id == client_id)
+
+    by_day, by_client, by_gateway, by_terminal = Counter(), Counter(), Counter(), Counter()
+    for day, row_client_id, gateway_id, terminal_id, shipments in db.session.execute(query):
+        by_day[day] += shipments
+        by_client[row_client_id] += shipments
+        by_gateway[gateway_id] += shipments
+        by_terminal[terminal_id] += shipments
+
+    def named(counts, reference):
+        names = dict(get_choices(reference))
+        return [(key, names.get(key, key), count) for key, count in counts.most_common()]
+
+    return {
+        'since': since,
+        'total': sum(by_day.values()),
+        'days': sorted(by_day.items(), reverse=True),
+        'clients': named(by_client, 'clients'),
+        'gateways': named(by_gateway, 'gateways'),
+        'terminals': named(by_terminal, 'terminals'),
+    }
+
+
+def rebuild_shipment_counters():
+    # Полный пересчёт из general_data одной транзакцией, например после загрузки данных в обход триггеров
+    day = func.date(GeneralData.created_at)
+    db.session.execute(delete(ShipmentCounter))
+    db.session.execute(insert(ShipmentCounter).from_select(
+        ['day', 'client_id', 'gateway_id', 'terminal_id', 'shipments'],
+        select(day, GeneralData.client_id, GeneralData.gateway_id, GeneralData.terminal_id, func.count())
+        .where(GeneralData.created_at.isnot(None))
+        .group_by(day, GeneralData.client_id, GeneralData.gateway_id, GeneralData.terminal_id)
+    ))
+    # Сводка в API кэшируется по версии general_data
+    bump_version('general_data')
+    db.session.commit()
+    return db.session.scalar(select(func.count()).select_from(ShipmentCounter))
@@ -0,0 +1,93 @@
+from sqlalchemy import event
+from models import db
+
+# Профиль подключения к SQLite для приложения из create_app (app.py).
+#
+# Каждое новое соединение получает PRAGMA из настроек приложения:
+#   SQLITE_JOURNAL_MODE  - режим журнала ('WAL': читатели не блокируют запись и наоборот)
+#   SQLITE_BUSY_TIMEOUT  - сколько миллисекунд ждать снятия блокировки вместо ошибки "database is locked" (5000)
+#   SQLITE_SYNCHRONOUS   - 'NORMAL' в режиме WAL безопасен при сбое процесса и намного быстрее 'FULL'
+#   SQLITE_CACHE_SIZE    - кэш страниц; отрицательное значение - размер в КиБ (-20000, около 20 МБ на соединение)
+#   SQLITE_MMAP_SIZE     - размер отображения файла базы в память в байтах (256 МБ, 0 - отключить)
+#   SQLITE_FOREIGN_KEYS  - проверять внешние ключи (True)
+# Пул соединений: SQLITE_POOL_SIZE (10), SQLITE_MAX_OVERFLOW (10), SQLITE_POOL_TIMEOUT (30 секунд).
+# Значения из SQLALCHEMY_ENGINE_OPTIONS в конфигурации имеют приоритет.
+
+PRAGMA_DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE': -20000,
+    'SQLITE_MMAP_SIZE': 268435456,
+    'SQLITE_FOREIGN_KEYS': True,
+}
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def _pragmas(config):
+    settings = {name: config.get(name, default) for name, default in PRAGMA_DEFAULTS.items()}
+    journal_mode = str(settings['SQLITE_JOURNAL_MODE']).upper()
+    synchronous = str(settings['SQLITE_SYNCHRONOUS']).upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f'Недопустимое значение SQLITE_JOURNAL_MODE: {journal_mode}')
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f'Недопустимое значение SQLITE_SYNCHRONOUS: {synchronous}')
+    # PRAGMA не поддерживает параметры, поэтому значения проверяются и приводятся выше
+    return [
+        f'PRAGMA journal_mode = {journal_mode}',
+        f'PRAGMA busy_timeout = {int(settings["SQLITE_BUSY_TIMEOUT"])}',
+        f'PRAGMA synchronous = {synchronous}',
+        f'PRAGMA cache_size = {int(settings["SQLITE_CACHE_SIZE"])}',
+        f'PRAGMA mmap_size = {int(settings["SQLITE_MMAP_SIZE"])}',
+        f'PRAGMA foreign_keys = {"ON" if settings["SQLITE_FOREIGN_KEYS"] else "OFF"}',
+    ]
+
+
+def engine_options(config):
+    options = {
+        'pool_size': config.get('SQLITE_POOL_SIZE', 10),
+        'max_overflow': config.get('SQLITE_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('SQLITE_POOL_TIMEOUT', 30),
+        'connect_args': {
+            # Соединения пула используются разными потоками (запросы, фоновые потоки писем и журнала)
+            'check_same_thread': False,
+            'timeout': int(config.get('SQLITE_BUSY_TIMEOUT', PRAGMA_DEFAULTS['SQLITE_BUSY_TIMEOUT'])) / 1000,
+        },
+    }
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    return options
+
+
+def init_db(app):
+    # Заменяет db.init_app(app): настраивает пул и PRAGMA для всех соединений приложения
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    if not uri.startswith('sqlite'):
+        db.init_app(app)
+        return
+    pragmas = _pragmas(app.config)
+    # Для базы в памяти пул не используется, остаются только PRAGMA
+    if ':memory:' not in uri and uri.rstrip('/') != 'sqlite:':
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def _set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+            finally:
+                cursor.close()
+
+
+def optimize_database(analyze=False):
+    # Обслуживание статистики планировщика: PRAGMA optimize дёшев и пересчитывает только устаревшую
+    # статистику, ANALYZE пересобирает её целиком (долго на больших таблицах).
+    with db.engine.connect() as connection:
+        if analyze:
+            connection.exec_driver_sql('ANALYZE')
+        connection.exec_driver_sql('PRAGMA optimize')
+        connection.commit()
@@ -0,0 +1,124 @@
+import csv
+import io
+import json
+from flask import current_app, Response, stream_with_context
+from sqlalchemy import select, type_coerce, String
+from models import db, GeneralData, Client, User, Gateway, Terminal, ExportContract, Log
+
+# Выгрузка читает строки курсором порциями по EXPORT_CHUNK_SIZE (yield_per) и сразу отдаёт их клиенту,
+# поэтому расход памяти не зависит от размера выгрузки.
+
+# Столбцы выгрузки general_data: (ключ JSON, заголовок CSV). Заголовки CSV совпадают с форматом импорта.
+GENERAL_DATA_COLUMNS = [
+    ('id', 'ID'),
+    ('client', 'Клиент'),
+    ('user', 'Пользователь'),
+    ('gateway', 'Шлюз'),
+    ('terminal', 'Терминал'),
+    ('export_contract', 'Экспортный контракт'),
+    ('vehicle', 'Транспортное средство'),
+    ('invoice_number', '№ Инвойса'),
+    ('delivery_address', 'Адрес доставки'),
+    ('created_at', 'Создано'),
+]
+
+LOG_COLUMNS = [
+    ('log_id', 'ID'),
+    ('user', 'Пользователь'),
+    ('action', 'Действие'),
+    ('table_name', 'Таблица'),
+    ('record_id', 'ID записи'),
+    ('details', 'Детали'),
+    ('created_at', 'Время'),
+]
+
+
+def general_data_statement(conditions):
+    # Один запрос с названиями справочников вместо загрузки ORM-объектов
+    return (
+        select(
+            GeneralData.id,
+            Client.name.label('client'),
+            User.username.label('user'),
+            Gateway.name.label('gateway'),
+            Terminal.name.label('terminal'),
+            ExportContract.number.label('export_contract'),
+            GeneralData.vehicle,
+            GeneralData.invoice_number,
+            GeneralData.delivery_address,
+            type_coerce(GeneralData.created_at, String).label('created_at'),
+        )
+        .join(Client, GeneralData.client_id == Client.client_id)
+        .join(User, GeneralData.user_id == User.user_id)
+        .join(Gateway, GeneralData.gateway_id == Gateway.gateway_id)
+        .join(Terminal, GeneralData.terminal_id == Terminal.terminal_id)
+        .join(ExportContract, GeneralData.export_contract_id == ExportContract.export_contract_id)
+        .where(*conditions)
+        .order_by(GeneralData.id)
+    )
+
+
+def log_statement(conditions):
+    return (
+        select(
+            Log.log_id,
+            User.username.label('user'),
+            Log.action,
+            Log.table_name,
+            Log.record_id,
+            Log.details,
+            type_coerce(Log.created_at, String).label('created_at'),
+        )
+        .outerjoin(User, Log.user_id == User.user_id)
+        .where(*conditions)
+        .order_by(Log.log_id)
+    )
+
+
+def _rows(statement):
+    chunk_size = current_app.config.get('EXPORT_CHUNK_SIZE', 1000)
+    result = db.session.execute(statement.execution_options(yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def stream_csv(statement, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM нужен, чтобы Excel открыл UTF-8 с кириллицей
+    buffer.write('\ufeff')
+    writer.writerow([header for _, header in columns])
+    for partition in _rows(statement):
+        writer.writerows(partition)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_json(statement, columns):
+    keys = [key for key, _ in columns]
+    yield '['
+    first = True
+    for partition in _rows(statement):
+        chunk = ','.join(json.dumps(dict(zip(keys, row)), ensure_ascii=False) for row in partition)
+        if chunk:
+            yield chunk if first else ',' + chunk
+            first = False
+    yield ']'
+
+
+def export_response(statement, columns, export_format, filename):
+    if export_format == 'json':
+        body, mimetype = stream_json(statement, columns), 'application/json'
+    else:
+        body, mimetype = stream_csv(statement, columns), 'text/csv'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
@@ -1,22 +1,30 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, SelectField, BooleanField, SubmitField, TextAreaField, DateField
 from wtforms.validators import DataRequired, Email, Length, EqualTo, ValidationError
 import re
 from models import User, Role, Client, Gateway, Terminal, ExportContract
 from flask_login import current_user
+from cache import get_choices, get_contract_choices, get_name
 
-def validate_password_strength(form, field):
-    password = field.data
+def password_error(password):
+    # Текст ошибки, если пароль слишком простой, иначе None (используется формами и командой create-admin)
     if len(password) < 8:
-        raise ValidationError("Пароль должен содержать минимум 8 символов.")
+        return "Пароль должен содержать минимум 8 символов."
     if not re.search(r"[A-Z]", password):
-        raise ValidationError("Пароль должен содержать хотя бы одну заглавную букву.")
+        return "Пароль должен содержать хотя бы одну заглавную букву."
     if not re.search(r"[a-z]", password):
-        raise ValidationError("Пароль должен содержать хотя бы одну строчную букву.")
+        return "Пароль должен содержать хотя бы одну строчную букву."
     if not re.search(r"\d", password):
-        raise ValidationError("Пароль должен содержать хотя бы одну цифру.")
+        return "Пароль должен содержать хотя бы одну цифру."
     if not re.search(r"[!@#$%^&*]", password):
-        raise ValidationError("Пароль должен содержать хотя бы один специальный символ (!@#$%^&*).")
+        return "Пароль должен содержать хотя бы один специальный символ (!@#$%^&*)."
+    return None
+
+def validate_password_strength(form, field):
+    error = password_error(field.data)
+    if error:
+        raise ValidationError(error)
 
 class LoginForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
@@ -60,8 +68,8 @@ class UserForm(FlaskForm):
     def __init__(self, user=None, *args, **kwargs):
         super(UserForm, self).__init__(*args, **kwargs)
         self.user = user
-        self.role_id.choices = [(role.role_id, role.name) for role in Role.query.all()]
-        self.client_id.choices = [(0, 'Нет')] + [(client.client_id, client.name) for client in Client.query.all()]
+        self.role_id.choices = get_choices('roles')
+        self.client_id.choices = [(0, 'Нет')] + get_choices('clients')
 
     def validate_username(self, username):
         existing_user = User.query.filter_by(username=username.data).first()
@@ -90,8 +98,8 @@ class InvitationForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(InvitationForm, self).__init__(*args, **kwargs)
-        self.role_id.choices = [(role.role_id, role.name) for role in Role.query.all()]
-        self.client_id.choices = [(0, 'Нет')] + [(client.client_id, client.name) for client in Client.query.all()]
+        self.role_id.choices = get_choices('roles')
+        self.client_id.choices = [(0, 'Нет')] + get_choices('clients')
 
 class GatewayForm(FlaskForm):
     name = StringField('Название шлюза', validators=[DataRequired(), Length(min=2, max=100)])
@@ -120,7 +128,7 @@ class ExportContractForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(ExportContractForm, self).__init__(*args, **kwargs)
-        self.client_id.choices = [(client.client_id, client.name) for client in Client.query.all()]
+        self.client_id.choices = get_choices('clients')
 
     def validate_number(self, number):
         existing_contract = ExportContract.query.filter_by(number=number.data).first()
@@ -139,11 +147,45 @@ class GeneralDataForm(FlaskForm):
 
     def __init__(self, *args, **kwargs):
         super(GeneralDataForm, self).__init__(*args, **kwargs)
-        self.client_id.choices = [(client.client_id, client.name) for client in Client.query.all()]
-        self.gateway_id.choices = [(gateway.gateway_id, gateway.name) for gateway in Gateway.query.all()]
-        self.terminal_id.choices = [(terminal.terminal_id, terminal.name) for terminal in Terminal.query.all()]
-        self.export_contract_id.choices = [(contract.export_contract_id, contract.number) for contract in ExportContract.query.all()]
+        # Справочники берутся из кэша, см. cache.py
+        self.client_id.choices = get_choices('clients')
+        self.gateway_id.choices = get_choices('gateways')
+        self.terminal_id.choices = get_choices('terminals')
+        self.export_contract_id.choices = get_contract_choices()
         # Ограничиваем выбор для пользователей с client_id
         if current_user.is_authenticated and current_user.client_id is not None and not current_user.is_admin():
-            self.client_id.choices = [(current_user.client_id, current_user.client.name)]
-            self.export_contract_id.choices = [(contract.export_contract_id, contract.number) for contract in ExportContract.query.filter_by(client_id=current_user.client_id).all()]
\ No newline at end of file
+            self.client_id.choices = [(current_user.client_id, get_name('clients', current_user.client_id))]
+            self.export_contract_id.choices = get_contract_choices(current_user.client_id)
+
+class GeneralDataBulkForm(FlaskForm):
+    # Выбранные записи передаются списком ids; 0 и пустое значение означают "не менять"
+    action = SelectField('Действие', choices=[('update', 'Изменить выбранные'), ('delete', 'Удалить выбранные')])
+    gateway_id = SelectField('Шлюз', coerce=int)
+    terminal_id = SelectField('Терминал', coerce=int)
+    export_contract_id = SelectField('Экспортный контракт', coerce=int)
+    vehicle = StringField('Транспортное средство', validators=[Length(max=100)])
+    clear_vehicle = BooleanField('Очистить транспортное средство')
+    submit = SubmitField('Применить')
+
+    def __init__(self, *args, **kwargs):
+        super(GeneralDataBulkForm, self).__init__(*args, **kwargs)
+        self.gateway_id.choices = [(0, 'Не менять')] + get_choices('gateways')
+        self.terminal_id.choices = [(0, 'Не менять')] + get_choices('terminals')
+        self.export_contract_id.choices = [(0, 'Не менять')] + get_contract_choices()
+        # Пользователи с client_id выбирают только контракты своего клиента
+        if current_user.is_authenticated and current_user.client_id is not None and not current_user.is_admin():
+            self.export_contract_id.choices = [(0, 'Не менять')] + get_contract_choices(current_user.client_id)
+
+    def values(self):
+        values = {field: getattr(self, field).data for field in ('gateway_id', 'terminal_id', 'export_contract_id')
+                  if getattr(self, field).data}
+        if self.clear_vehicle.data:
+            values['vehicle'] = None
+        elif self.vehicle.data:
+            values['vehicle'] = self.vehicle.data
+        return values
+
+class GeneralDataImportForm(FlaskForm):
+    file = FileField('Файл CSV или XLSX', validators=[FileRequired(), FileAllowed(['csv', 'xlsx'], 'Поддерживаются только файлы CSV и XLSX.')])
+    preview = SubmitField('Проверить')
+    submit = SubmitField('Импортировать')
@@ -0,0 +1,36 @@
+import glob
+import multiprocessing
+import os
+
+# Настройки gunicorn для рабочего режима: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Переменные окружения:
+#   ERP_BIND                  - адрес (0.0.0.0:5000)
+#   WEB_CONCURRENCY           - число процессов (число ядер * 2 + 1)
+#   ERP_THREADS               - потоков в процессе (4); потоковые страницы и выгрузки не занимают весь процесс
+#   ERP_TIMEOUT               - сколько секунд воркер может не отвечать до перезапуска (120, долгие выгрузки)
+#   PROMETHEUS_MULTIPROC_DIR  - каталог метрик для нескольких процессов (см. metrics.py), очищается при запуске
+
+bind = os.environ.get('ERP_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('ERP_THREADS', 4))
+timeout = int(os.environ.get('ERP_TIMEOUT', 120))
+# Приложение создаётся и разогревается один раз в главном процессе (wsgi.py), воркеры получают его при fork
+preload_app = True
+# Перезапуск воркеров по очереди ограничивает рост памяти при долгой работе
+max_requests = 10000
+max_requests_jitter = 1000
+
+# Файлы метрик прошлого запуска относятся к завершённым процессам. Каталог готовится здесь, а не в хуке:
+# файл настроек читается до загрузки приложения, а метрики создаются уже при импорте metrics.py
+_metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if _metrics_dir:
+    os.makedirs(_metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(_metrics_dir, '*.db')):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,148 @@
+import csv
+import io
+from flask import current_app
+from sqlalchemy import insert
+from models import db, GeneralData
+from cache import get_choices, get_reference
+from audit import record, make_entry
+
+# Заголовки столбцов файла импорта: поле -> допустимые варианты (в нижнем регистре)
+COLUMNS = {
+    'client': ('client', 'клиент'),
+    'gateway': ('gateway', 'шлюз'),
+    'terminal': ('terminal', 'терминал'),
+    'export_contract': ('export_contract', 'экспортный контракт', 'контракт'),
+    'vehicle': ('vehicle', 'транспортное средство'),
+    'invoice_number': ('invoice_number', '№ инвойса', 'инвойс'),
+    'delivery_address': ('delivery_address', 'адрес доставки'),
+}
+
+# Максимальная длина текстовых полей, как в GeneralDataForm
+MAX_LENGTHS = {
+    'vehicle': (100, 'Транспортное средство'),
+    'invoice_number': (50, '№ Инвойса'),
+    'delivery_address': (200, 'Адрес доставки'),
+}
+
+# Поля записи, попадающие в лог создания, как в general.new_entry
+LOGGED_FIELDS = ('client_id', 'gateway_id', 'terminal_id', 'export_contract_id', 'vehicle', 'invoice_number', 'delivery_address')
+
+
+def read_rows(file_storage):
+    # Возвращает список словарей "заголовок -> значение" из CSV или XLSX
+    filename = (file_storage.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_storage.stream, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return []
+        header = [str(cell).strip() if cell is not None else '' for cell in header]
+        return [dict(zip(header, ['' if cell is None else str(cell).strip() for cell in row])) for row in rows
+                if any(cell not in (None, '') for cell in row)]
+    text = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(text, dialect=dialect)
+    return [{(key or '').strip(): (value or '').strip() for key, value in row.items()} for row in reader
+            if any((value or '').strip() for value in row.values())]
+
+
+def _map_header(row):
+    mapped = {}
+    for key, value in row.items():
+        for field, aliases in COLUMNS.items():
+            if key.lower() in aliases:
+                mapped[field] = value
+    return mapped
+
+
+def validate_rows(rows, user):
+    # Проверяет строки файла и переводит названия справочников в id без запросов на каждую строку.
+    # Возвращает (валидные строки для вставки, [(номер строки, [ошибки])], первые валидные строки в исходном виде).
+    clients = {name: client_id for client_id, name in get_choices('clients')}
+    gateways = {name: gateway_id for gateway_id, name in get_choices('gateways')}
+    terminals = {name: terminal_id for terminal_id, name in get_choices('terminals')}
+    contracts = {number: (contract_id, client_id) for contract_id, number, client_id in get_reference('export_contracts')}
+    restricted = user.client_id is not None and not user.is_admin()
+
+    valid, errors, preview = [], [], []
+    # Строка 1 - заголовок
+    for row_number, raw in enumerate(rows, start=2):
+        row = _map_header(raw)
+        row_errors = []
+        client_name = row.get('client', '')
+        if restricted:
+            # Пользователи с client_id загружают записи только своего клиента
+            if client_name and clients.get(client_name) != user.client_id:
+                row_errors.append(f'Нет доступа к клиенту «{client_name}».')
+            client_id = user.client_id
+        elif not client_name:
+            row_errors.append('Не указан клиент.')
+            client_id = None
+        else:
+            client_id = clients.get(client_name)
+            if client_id is None:
+                row_errors.append(f'Клиент «{client_name}» не найден.')
+        resolved = {}
+        for field, lookup, label in (('gateway', gateways, 'Шлюз'), ('terminal', terminals, 'Терминал')):
+            name = row.get(field, '')
+            if not name:
+                row_errors.append(f'Не указан {label.lower()}.')
+            elif name not in lookup:
+                row_errors.append(f'{label} «{name}» не найден.')
+            else:
+                resolved[field] = lookup[name]
+        number = row.get('export_contract', '')
+        if not number:
+            row_errors.append('Не указан экспортный контракт.')
+        elif number not in contracts:
+            row_errors.append(f'Экспортный контракт «{number}» не найден.')
+        elif restricted and contracts[number][1] != user.client_id:
+            row_errors.append(f'Нет доступа к экспортному контракту «{number}».')
+        if not row.get('invoice_number'):
+            row_errors.append('Не указан № инвойса.')
+        for field, (max_length, label) in MAX_LENGTHS.items():
+            if len(row.get(field, '')) > max_length:
+                row_errors.append(f'Поле «{label}» длиннее {max_length} символов.')
+        if row_errors:
+            errors.append((row_number, row_errors))
+            continue
+        valid.append({
+            'client_id': client_id,
+            'gateway_id': resolved['gateway'],
+            'terminal_id': resolved['terminal'],
+            'export_contract_id': contracts[number][0],
+            'vehicle': row.get('vehicle') or None,
+            'invoice_number': row['invoice_number'],
+            'delivery_address': row.get('delivery_address') or None,
+            'user_id': user.user_id,
+        })
+        if len(preview) < 20:
+            preview.append(dict(row, client=client_name or dict(get_choices('clients')).get(client_id)))
+    return valid, errors, preview
+
+
+def import_rows(rows, user_id):
+    # Вставляет записи пачками по IMPORT_BATCH_SIZE, каждая пачка вместе с логами в своей транзакции
+    # (в режиме AUDIT_MODE='buffered' логи пишутся после commit)
+    batch_size = current_app.config.get('IMPORT_BATCH_SIZE', 500)
+    imported = 0
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        # RETURNING возвращает вставленные значения целиком, поэтому лог строится по ним,
+        # не полагаясь на порядок строк в ответе
+        inserted = db.session.execute(insert(GeneralData).returning(*[getattr(GeneralData, field) for field in ('id',) + LOGGED_FIELDS]), batch).all()
+        # Массовая вставка идёт в обход событий ORM, поэтому лог пишется явно
+        record(db.session, [
+            make_entry(user_id, 'create', 'general_data', row.id, {field: getattr(row, field) for field in LOGGED_FIELDS})
+            for row in inserted
+        ])
+        db.session.commit()
+        imported += len(batch)
+    return imported
@@ -0,0 +1,227 @@
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from sqlalchemy import select, update, and_, or_
+from models import db, EmailOutbox
+from metrics import SMTP_SEND_LATENCY, SMTP_FAILURES
+from email_config import SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, FROM_EMAIL
+
+# Письма сначала сохраняются в таблицу email_outbox, а фоновый поток отправляет их,
+# переиспользуя SMTP-соединения и повторяя неудачные попытки с экспоненциальной задержкой.
+#
+# Настройки приложения:
+#   MAIL_OUTBOX_WORKER       - запускать фоновый поток отправки (по умолчанию True)
+#   MAIL_DEBUG_SERVER        - 'host:port' локального отладочного SMTP-сервера без TLS и авторизации,
+#                              например `python -m aiosmtpd -n -l localhost:1025`
+#   MAIL_MAX_ATTEMPTS        - число попыток до статуса 'failed' (5)
+#   MAIL_RETRY_BASE_SECONDS  - первая задержка повтора, далее удваивается (30)
+#   MAIL_RETRY_MAX_SECONDS   - максимальная задержка повтора (3600)
+#   MAIL_POLL_INTERVAL       - период опроса очереди в секундах (5)
+#   MAIL_BATCH_SIZE          - сколько писем забирать за один проход (20)
+
+
+class SMTPPool:
+    def __init__(self, host, port, username=None, password=None, use_tls=True, max_idle=2, idle_timeout=60, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                connection, released_at = self._idle.pop()
+                if time.monotonic() - released_at < self.idle_timeout:
+                    return connection, True
+                self.discard(connection)
+        return self._connect(), False
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((connection, time.monotonic()))
+                return
+        self.discard(connection)
+
+    def discard(self, connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def close_idle(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            expired = [item for item in self._idle if force or now - item[1] >= self.idle_timeout]
+            self._idle = [item for item in self._idle if item not in expired]
+        for connection, _ in expired:
+            self.discard(connection)
+
+    def send(self, from_email, to_email, message):
+        connection, reused = self.acquire()
+        try:
+            connection.sendmail(from_email, to_email, message)
+        except smtplib.SMTPServerDisconnected:
+            self.discard(connection)
+            if not reused:
+                raise
+            # Сервер закрыл простаивающее соединение - повторяем один раз на новом
+            connection = self._connect()
+            try:
+                connection.sendmail(from_email, to_email, message)
+            except (smtplib.SMTPException, OSError):
+                self.discard(connection)
+                raise
+        except (smtplib.SMTPException, OSError):
+            self.discard(connection)
+            raise
+        self.release(connection)
+
+
+def create_pool(app):
+    debug_server = app.config.get('MAIL_DEBUG_SERVER')
+    if debug_server:
+        host, _, port = debug_server.partition(':')
+        return SMTPPool(host, int(port or 25), use_tls=False)
+    return SMTPPool(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, use_tls=True)
+
+
+def enqueue_email(to_email, subject, body):
+    # Письмо уходит после commit вызывающего кода; затем стоит вызвать wake_worker()
+    email = EmailOutbox(to_email=to_email, subject=subject, body=body, next_attempt_at=datetime.utcnow())
+    db.session.add(email)
+    return email
+
+
+def _retry_delay(app, attempts):
+    base = app.config.get('MAIL_RETRY_BASE_SECONDS', 30)
+    return min(base * 2 ** (attempts - 1), app.config.get('MAIL_RETRY_MAX_SECONDS', 3600))
+
+
+def _claim_batch(app):
+    now = datetime.utcnow()
+    # Письма в статусе 'sending' дольше 10 минут считаем брошенными упавшим процессом
+    due = or_(
+        and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+        and_(EmailOutbox.status == 'sending', EmailOutbox.locked_at < now - timedelta(minutes=10))
+    )
+    candidate_ids = db.session.execute(
+        select(EmailOutbox.email_id).where(due).order_by(EmailOutbox.next_attempt_at).limit(app.config.get('MAIL_BATCH_SIZE', 20))
+    ).scalars().all()
+    claimed = []
+    for email_id in candidate_ids:
+        # Условный UPDATE гарантирует, что письмо заберёт только один процесс
+        result = db.session.execute(
+            update(EmailOutbox).where(EmailOutbox.email_id == email_id, due).values(status='sending', locked_at=now)
+        )
+        if result.rowcount:
+            claimed.append(email_id)
+    db.session.commit()
+    return claimed
+
+
+def process_outbox(app, pool):
+    # Отправляет все письма, срок отправки которых наступил. Возвращает (отправлено, с ошибкой).
+    sent = failed = 0
+    while True:
+        claimed = _claim_batch(app)
+        if not claimed:
+            return sent, failed
+        for email_id in claimed:
+            email = db.session.get(EmailOutbox, email_id)
+            msg = MIMEText(email.body)
+            msg['Subject'] = email.subject
+            msg['From'] = FROM_EMAIL
+            msg['To'] = email.to_email
+            email.attempts += 1
+            start = time.perf_counter()
+            try:
+                pool.send(FROM_EMAIL, email.to_email, msg.as_string())
+            except (smtplib.SMTPException, OSError) as e:
+                SMTP_FAILURES.inc()
+                app.logger.warning(f"Ошибка отправки email {email.email_id} на {email.to_email}: {e}")
+                email.last_error = str(e)
+                if email.attempts >= app.config.get('MAIL_MAX_ATTEMPTS', 5):
+                    email.status = 'failed'
+                else:
+                    email.status = 'pending'
+                    email.next_attempt_at = datetime.utcnow() + timedelta(seconds=_retry_delay(app, email.attempts))
+                failed += 1
+            else:
+                SMTP_SEND_LATENCY.observe(time.perf_counter() - start)
+                email.status = 'sent'
+                email.sent_at = datetime.utcnow()
+                email.last_error = None
+                sent += 1
+            email.locked_at = None
+            db.session.commit()
+
+
+class OutboxWorker(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='email-outbox', daemon=True)
+        self.app = app
+        self.pool = create_pool(app)
+        self.wakeup = threading.Event()
+
+    def run(self):
+        interval = self.app.config.get('MAIL_POLL_INTERVAL', 5)
+        while True:
+            with self.app.app_context():
+                try:
+                    process_outbox(self.app, self.pool)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Ошибка обработки очереди писем")
+                finally:
+                    db.session.remove()
+            self.pool.close_idle()
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+
+# Один поток отправки на процесс; после fork воркера поток запускается заново
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def start_worker(app):
+    global _worker, _worker_pid
+    if not app.config.get('MAIL_OUTBOX_WORKER', True):
+        return None
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid() or not _worker.is_alive():
+            _worker = OutboxWorker(app)
+            _worker_pid = os.getpid()
+            _worker.start()
+    return _worker
+
+
+def wake_worker():
+    if _worker is not None and _worker_pid == os.getpid():
+        _worker.wakeup.set()
+
+
+def init_mailer(app):
+    @app.before_request
+    def _ensure_outbox_worker():
+        if _worker is None or _worker_pid != os.getpid():
+            start_worker(app)
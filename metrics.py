@@ -0,0 +1,124 @@
+import os
+import time
+from flask import Blueprint, Response, current_app, g, request, has_request_context, abort
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from models import db
+
+# Метрики в текстовом формате Prometheus на /metrics.
+#
+# В нескольких процессах (gunicorn и т.п.) перед запуском задайте переменную окружения PROMETHEUS_MULTIPROC_DIR -
+# пустой каталог, доступный всем воркерам. Каждый процесс пишет значения в свои файлы, а /metrics в любом
+# воркере суммирует их. После завершения воркера вызывайте mark_process_dead(pid) (см. хук child_exit gunicorn).
+# Без переменной метрики собираются только в текущем процессе.
+#
+# Настройки приложения:
+#   METRICS_ENABLED  - собирать метрики и отдавать /metrics (True)
+#   METRICS_TOKEN    - если задан, /metrics требует заголовок Authorization: Bearer <токен>
+
+REQUEST_LATENCY = Histogram(
+    'erp_request_duration_seconds', 'Время обработки запроса, включая потоковую отправку тела',
+    ['blueprint', 'endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUESTS = Counter('erp_requests_total', 'Число запросов', ['blueprint', 'endpoint', 'method', 'status'])
+REQUEST_SQL_QUERIES = Histogram(
+    'erp_request_sql_queries', 'Число SQL-запросов за один HTTP-запрос', ['blueprint', 'endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+REQUEST_SQL_TIME = Histogram(
+    'erp_request_sql_seconds', 'Суммарное время SQL-запросов за один HTTP-запрос', ['blueprint', 'endpoint'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+SQL_QUERIES = Counter('erp_sql_queries_total', 'Число SQL-запросов, включая фоновые потоки')
+POOL_CHECKED_OUT = Gauge('erp_db_pool_checked_out', 'Соединений пула, выданных в работу', multiprocess_mode='livesum')
+POOL_SIZE = Gauge('erp_db_pool_size', 'Соединений, открытых пулом', multiprocess_mode='livesum')
+SMTP_SEND_LATENCY = Histogram(
+    'erp_smtp_send_seconds', 'Время отправки письма через SMTP', buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+SMTP_FAILURES = Counter('erp_smtp_failures_total', 'Неудачные попытки отправки писем')
+CACHE_REQUESTS = Counter('erp_cache_requests_total', 'Обращения к кэшам приложения', ['cache', 'result'])
+
+
+def cache_hit(name):
+    CACHE_REQUESTS.labels(name, 'hit').inc()
+
+
+def cache_miss(name):
+    CACHE_REQUESTS.labels(name, 'miss').inc()
+
+
+def mark_process_dead(pid):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def _labels():
+    return request.blueprint or '', request.endpoint or 'none'
+
+
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    app.register_blueprint(metrics_bp)
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_start'].pop()
+        SQL_QUERIES.inc()
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_sql_queries += 1
+            g.metrics_sql_time += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        if context.connection is not None and context.connection.info.get('metrics_start'):
+            context.connection.info['metrics_start'].pop()
+
+    @app.before_request
+    def _start_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_queries = 0
+        g.metrics_sql_time = 0.0
+
+    @app.after_request
+    def _response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    # Замер в teardown: для потоковых ответов он выполняется после отправки всего тела
+    @app.teardown_request
+    def _finish_request(exc):
+        if 'metrics_start' not in g:
+            return
+        blueprint, endpoint = _labels()
+        # GeneratorExit - клиент закрыл соединение во время потоковой отправки, статус уже отправлен
+        status = 500 if exc is not None and not isinstance(exc, GeneratorExit) else g.get('metrics_status', 500)
+        REQUEST_LATENCY.labels(blueprint, endpoint, request.method).observe(time.perf_counter() - g.metrics_start)
+        REQUESTS.labels(blueprint, endpoint, request.method, str(status)).inc()
+        REQUEST_SQL_QUERIES.labels(blueprint, endpoint).observe(g.metrics_sql_queries)
+        REQUEST_SQL_TIME.labels(blueprint, endpoint).observe(g.metrics_sql_time)
+        pool = engine.pool
+        if hasattr(pool, 'checkedout'):
+            POOL_CHECKED_OUT.set(pool.checkedout())
+            POOL_SIZE.set(pool.checkedin() + pool.checkedout())
+        g.pop('metrics_start', None)
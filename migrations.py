@@ -0,0 +1,234 @@
+from models import db
+
+# Версионные миграции схемы SQLite. Текущая версия хранится в PRAGMA user_version.
+# Каждый шаг - SQL-строка или функция, принимающая соединение.
+# Новые миграции добавляются только в конец списка, уже выпущенные не меняются.
+
+
+def add_column(table, column, definition):
+    # ALTER TABLE ADD COLUMN без IF NOT EXISTS: новая база, созданная db.create_all(), уже содержит столбец
+    def step(connection):
+        columns = [row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+MIGRATIONS = [
+    (1, 'Индексы для частых фильтров и сортировок', [
+        'CREATE INDEX IF NOT EXISTS ix_general_data_created_at_id ON general_data (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_general_data_client_id_created_at_id ON general_data (client_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_export_contracts_client_id ON export_contracts (client_id)',
+        'CREATE INDEX IF NOT EXISTS ix_logs_created_at ON logs (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_logs_table_name_record_id_log_id ON logs (table_name, record_id, log_id)',
+        'CREATE INDEX IF NOT EXISTS ix_invitations_used_expires_at ON invitations (used, expires_at)',
+        'CREATE INDEX IF NOT EXISTS ix_password_reset_tokens_user_id ON password_reset_tokens (user_id)',
+        'ANALYZE',
+    ]),
+    (2, 'Таблица версий справочных данных для кэша', [
+        'CREATE TABLE IF NOT EXISTS data_versions (name VARCHAR(50) PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)',
+    ]),
+    (3, 'Очередь исходящих писем', [
+        '''CREATE TABLE IF NOT EXISTS email_outbox (
+            email_id INTEGER PRIMARY KEY,
+            to_email VARCHAR(120) NOT NULL,
+            subject VARCHAR(200) NOT NULL,
+            body TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at DATETIME NOT NULL,
+            locked_at DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME
+        )''',
+        'CREATE INDEX IF NOT EXISTS ix_email_outbox_status_next_attempt_at ON email_outbox (status, next_attempt_at)',
+    ]),
+    (4, 'Построчные изменения полей из logs.details для поиска по журналу', [
+        '''CREATE TABLE IF NOT EXISTS log_changes (
+            change_id INTEGER PRIMARY KEY,
+            log_id INTEGER NOT NULL REFERENCES logs (log_id),
+            field VARCHAR(50) NOT NULL,
+            old_value TEXT,
+            new_value TEXT,
+            changed BOOLEAN NOT NULL DEFAULT 1
+        )''',
+        # Заполнение по существующим логам средствами JSON1
+        '''INSERT INTO log_changes (log_id, field, old_value, new_value, changed)
+           SELECT l.log_id, j.key, NULL, j.value, 1
+           FROM logs l, json_each(l.details) j
+           WHERE l.action = 'create' AND json_valid(l.details)''',
+        '''INSERT INTO log_changes (log_id, field, old_value, new_value, changed)
+           SELECT l.log_id, j.key, j.value, NULL, 1
+           FROM logs l, json_each(l.details) j
+           WHERE l.action = 'delete' AND json_valid(l.details)''',
+        '''INSERT INTO log_changes (log_id, field, old_value, new_value, changed)
+           SELECT l.log_id, n.key, o.value, n.value, o.value IS NOT n.value
+           FROM logs l
+           JOIN json_each(l.details, '$.new') n
+           LEFT JOIN json_each(l.details, '$.old') o ON o.key = n.key
+           WHERE l.action = 'update' AND json_valid(l.details)''',
+        'CREATE INDEX IF NOT EXISTS ix_log_changes_log_id ON log_changes (log_id)',
+        'CREATE INDEX IF NOT EXISTS ix_log_changes_field_new_value ON log_changes (field, new_value)',
+        'CREATE INDEX IF NOT EXISTS ix_log_changes_field_old_value ON log_changes (field, old_value)',
+        'CREATE INDEX IF NOT EXISTS ix_logs_user_id_log_id ON logs (user_id, log_id)',
+    ]),
+    (5, 'Полнотекстовый поиск по general_data (FTS5, триграммы)', [
+        # Внешнее содержимое: текст хранится только в general_data, индекс синхронизируют триггеры
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS general_data_fts USING fts5(
+            invoice_number, vehicle, delivery_address,
+            content='general_data', content_rowid='id', tokenize='trigram'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS general_data_fts_ai AFTER INSERT ON general_data BEGIN
+            INSERT INTO general_data_fts (rowid, invoice_number, vehicle, delivery_address)
+            VALUES (new.id, new.invoice_number, new.vehicle, new.delivery_address);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS general_data_fts_ad AFTER DELETE ON general_data BEGIN
+            INSERT INTO general_data_fts (general_data_fts, rowid, invoice_number, vehicle, delivery_address)
+            VALUES ('delete', old.id, old.invoice_number, old.vehicle, old.delivery_address);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS general_data_fts_au AFTER UPDATE OF invoice_number, vehicle, delivery_address ON general_data BEGIN
+            INSERT INTO general_data_fts (general_data_fts, rowid, invoice_number, vehicle, delivery_address)
+            VALUES ('delete', old.id, old.invoice_number, old.vehicle, old.delivery_address);
+            INSERT INTO general_data_fts (rowid, invoice_number, vehicle, delivery_address)
+            VALUES (new.id, new.invoice_number, new.vehicle, new.delivery_address);
+        END''',
+        "INSERT INTO general_data_fts (general_data_fts) VALUES ('rebuild')",
+    ]),
+    (6, 'Индексы для фильтров и сортировки списка general_data', [
+        'CREATE INDEX IF NOT EXISTS ix_general_data_gateway_id_created_at_id ON general_data (gateway_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_general_data_terminal_id_created_at_id ON general_data (terminal_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_general_data_export_contract_id_created_at_id ON general_data (export_contract_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_general_data_user_id_created_at_id ON general_data (user_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_general_data_invoice_number_id ON general_data (invoice_number, id)',
+        "CREATE INDEX IF NOT EXISTS ix_general_data_vehicle_id ON general_data (coalesce(vehicle, ''), id)",
+        "CREATE INDEX IF NOT EXISTS ix_general_data_delivery_address_id ON general_data (coalesce(delivery_address, ''), id)",
+        'ANALYZE',
+    ]),
+    (7, 'Время изменения версий данных и версия general_data для условных запросов API', [
+        add_column('data_versions', 'updated_at', 'DATETIME'),
+        # Версию general_data меняют триггеры, поэтому её учитывают и массовые операции в обход ORM
+        '''CREATE TRIGGER IF NOT EXISTS general_data_version_ai AFTER INSERT ON general_data BEGIN
+            INSERT INTO data_versions (name, version, updated_at) VALUES ('general_data', 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS general_data_version_au AFTER UPDATE ON general_data BEGIN
+            INSERT INTO data_versions (name, version, updated_at) VALUES ('general_data', 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS general_data_version_ad AFTER DELETE ON general_data BEGIN
+            INSERT INTO data_versions (name, version, updated_at) VALUES ('general_data', 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+        END''',
+    ]),
+    (8, 'Ограничение частоты попыток входа и восстановления пароля', [
+        '''CREATE TABLE IF NOT EXISTS rate_limits (
+            key VARCHAR(200) PRIMARY KEY,
+            tokens FLOAT NOT NULL,
+            updated_at FLOAT NOT NULL
+        )''',
+    ]),
+    (9, 'Счётчики отгрузок по дням для главной страницы', [
+        '''CREATE TABLE IF NOT EXISTS shipment_counters (
+            day DATE NOT NULL,
+            client_id INTEGER NOT NULL REFERENCES clients (client_id),
+            gateway_id INTEGER NOT NULL REFERENCES gateways (gateway_id),
+            terminal_id INTEGER NOT NULL REFERENCES terminals (terminal_id),
+            shipments INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, client_id, gateway_id, terminal_id)
+        )''',
+        'CREATE INDEX IF NOT EXISTS ix_shipment_counters_client_id_day ON shipment_counters (client_id, day)',
+        '''CREATE TRIGGER IF NOT EXISTS shipment_counters_ai AFTER INSERT ON general_data WHEN new.created_at IS NOT NULL BEGIN
+            INSERT INTO shipment_counters (day, client_id, gateway_id, terminal_id, shipments)
+            VALUES (date(new.created_at), new.client_id, new.gateway_id, new.terminal_id, 1)
+            ON CONFLICT (day, client_id, gateway_id, terminal_id) DO UPDATE SET shipments = shipments + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS shipment_counters_ad AFTER DELETE ON general_data WHEN old.created_at IS NOT NULL BEGIN
+            UPDATE shipment_counters SET shipments = shipments - 1
+            WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id;
+            DELETE FROM shipment_counters
+            WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id
+                AND shipments <= 0;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS shipment_counters_au AFTER UPDATE OF created_at, client_id, gateway_id, terminal_id ON general_data
+        WHEN date(old.created_at) IS NOT date(new.created_at) OR old.client_id != new.client_id
+            OR old.gateway_id != new.gateway_id OR old.terminal_id != new.terminal_id BEGIN
+            UPDATE shipment_counters SET shipments = shipments - 1
+            WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id;
+            DELETE FROM shipment_counters
+            WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id
+                AND shipments <= 0;
+            INSERT INTO shipment_counters (day, client_id, gateway_id, terminal_id, shipments)
+            SELECT date(new.created_at), new.client_id, new.gateway_id, new.terminal_id, 1 WHERE new.created_at IS NOT NULL
+            ON CONFLICT (day, client_id, gateway_id, terminal_id) DO UPDATE SET shipments = shipments + 1;
+        END''',
+        'DELETE FROM shipment_counters',
+        '''INSERT INTO shipment_counters (day, client_id, gateway_id, terminal_id, shipments)
+        SELECT date(created_at), client_id, gateway_id, terminal_id, count(*) FROM general_data
+        WHERE created_at IS NOT NULL GROUP BY date(created_at), client_id, gateway_id, terminal_id''',
+    ]),
+    (10, 'Состояние периодических задач обслуживания', [
+        '''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name VARCHAR(50) PRIMARY KEY,
+            next_run_at DATETIME NOT NULL,
+            locked_by VARCHAR(100),
+            locked_until DATETIME,
+            last_run_at DATETIME,
+            last_duration FLOAT,
+            last_result TEXT,
+            last_error TEXT
+        )''',
+    ]),
+    (11, 'Журнал медленных SQL-запросов', [
+        '''CREATE TABLE IF NOT EXISTS slow_queries (
+            id INTEGER PRIMARY KEY,
+            fingerprint VARCHAR(16) NOT NULL,
+            statement TEXT NOT NULL,
+            parameter_shape TEXT,
+            endpoint VARCHAR(100),
+            duration_ms FLOAT NOT NULL,
+            plan TEXT,
+            created_at DATETIME NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS ix_slow_queries_created_at ON slow_queries (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_slow_queries_fingerprint_created_at ON slow_queries (fingerprint, created_at)',
+    ]),
+]
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_version(connection):
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def set_version(connection, version):
+    # PRAGMA не поддерживает параметры, версия всегда целое число из MIGRATIONS
+    connection.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def upgrade(engine=None):
+    # Применяет недостающие миграции, каждую в своей транзакции. Возвращает список применённых версий.
+    engine = engine or db.engine
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        with engine.begin() as connection:
+            if get_version(connection) >= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.exec_driver_sql(step)
+            set_version(connection, version)
+        applied.append((version, description))
+    return applied
+
+
+def stamp(engine=None, version=None):
+    # Помечает базу как находящуюся на указанной (по умолчанию последней) версии без выполнения миграций
+    engine = engine or db.engine
+    with engine.begin() as connection:
+        set_version(connection, latest_version() if version is None else version)
@@ -49,6 +49,10 @@ class Invitation(db.Model):
     expires_at = db.Column(db.DateTime, server_default=db.text("(datetime('now', '+1 day'))"))
     used = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_invitations_used_expires_at', 'used', 'expires_at'),
+    )
+
     role = db.relationship('Role', backref='invitations', lazy=True)
     client = db.relationship('Client', backref='invitations', lazy=True)
 
@@ -56,7 +60,7 @@ class PasswordResetToken(db.Model):
     __tablename__ = 'password_reset_tokens'
     token_id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(36), default=lambda: str(uuid.uuid4()), unique=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
     expires_at = db.Column(db.DateTime, server_default=db.text("(datetime('now', '+1 hour'))"))
 
@@ -78,7 +82,7 @@ class ExportContract(db.Model):
     export_contract_id = db.Column(db.Integer, primary_key=True)
     number = db.Column(db.String(50), nullable=False, unique=True)
     date = db.Column(db.Date, nullable=False)
-    client_id = db.Column(db.Integer, db.ForeignKey('clients.client_id'), nullable=False)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.client_id'), nullable=False, index=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
 
@@ -98,6 +102,21 @@ class GeneralData(db.Model):
     delivery_address = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
 
+    __table_args__ = (
+        # Список записей упорядочен по (created_at, id), в том числе в разрезе клиента
+        db.Index('ix_general_data_created_at_id', 'created_at', 'id'),
+        db.Index('ix_general_data_client_id_created_at_id', 'client_id', 'created_at', 'id'),
+        # Фильтры списка по справочникам с сортировкой по дате
+        db.Index('ix_general_data_gateway_id_created_at_id', 'gateway_id', 'created_at', 'id'),
+        db.Index('ix_general_data_terminal_id_created_at_id', 'terminal_id', 'created_at', 'id'),
+        db.Index('ix_general_data_export_contract_id_created_at_id', 'export_contract_id', 'created_at', 'id'),
+        db.Index('ix_general_data_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+        # Сортировка списка по текстовым столбцам (см. SORT_COLUMNS в blueprints/general.py)
+        db.Index('ix_general_data_invoice_number_id', 'invoice_number', 'id'),
+        db.Index('ix_general_data_vehicle_id', db.text("coalesce(vehicle, '')"), 'id'),
+        db.Index('ix_general_data_delivery_address_id', db.text("coalesce(delivery_address, '')"), 'id'),
+    )
+
     client = db.relationship('Client', backref='general_data_entries', lazy=True)
     user = db.relationship('User', backref='general_data_entries', lazy=True)
     gateway = db.relationship('Gateway', backref='general_data_entries', lazy=True)
@@ -112,6 +131,102 @@ class Log(db.Model):
     table_name = db.Column(db.String(50), nullable=False)
     record_id = db.Column(db.Integer, nullable=False)
     details = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp(), index=True)
+
+    __table_args__ = (
+        # История конкретной записи выводится в порядке log_id
+        db.Index('ix_logs_table_name_record_id_log_id', 'table_name', 'record_id', 'log_id'),
+        db.Index('ix_logs_user_id_log_id', 'user_id', 'log_id'),
+    )
+
+    user = db.relationship('User', backref='logs', lazy=True)
+    changes = db.relationship('LogChange', backref='log', lazy=True)
+
+class LogChange(db.Model):
+    # Поля из Log.details построчно, чтобы искать по полю и значению через индекс
+    __tablename__ = 'log_changes'
+    change_id = db.Column(db.Integer, primary_key=True)
+    log_id = db.Column(db.Integer, db.ForeignKey('logs.log_id'), nullable=False, index=True)
+    field = db.Column(db.String(50), nullable=False)
+    old_value = db.Column(db.Text)
+    new_value = db.Column(db.Text)
+    changed = db.Column(db.Boolean, nullable=False, default=True)
+
+    __table_args__ = (
+        db.Index('ix_log_changes_field_new_value', 'field', 'new_value'),
+        db.Index('ix_log_changes_field_old_value', 'field', 'old_value'),
+    )
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Время последнего изменения, для заголовка Last-Modified в API
+    updated_at = db.Column(db.DateTime)
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+    email_id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'sending', 'sent', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, server_default=db.func.current_timestamp())
-
-    user = db.relationship('User', backref='logs', lazy=True)
\ No newline at end of file
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+class RateLimit(db.Model):
+    # Ведро токенов для ограничения частоты попыток (см. security.py); updated_at - время Unix
+    __tablename__ = 'rate_limits'
+    key = db.Column(db.String(200), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+class ShipmentCounter(db.Model):
+    # Число записей general_data за день в разрезе клиента, шлюза и терминала.
+    # Поддерживается триггерами на general_data (migrations.py), пересчитывается командой flask rebuild-counters
+    __tablename__ = 'shipment_counters'
+    day = db.Column(db.Date, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('clients.client_id'), primary_key=True)
+    gateway_id = db.Column(db.Integer, db.ForeignKey('gateways.gateway_id'), primary_key=True)
+    terminal_id = db.Column(db.Integer, db.ForeignKey('terminals.terminal_id'), primary_key=True)
+    shipments = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_shipment_counters_client_id_day', 'client_id', 'day'),
+    )
+
+class ScheduledJob(db.Model):
+    # Состояние периодических задач обслуживания (см. scheduler.py); locked_by/locked_until - аренда процессом
+    __tablename__ = 'scheduled_jobs'
+    name = db.Column(db.String(50), primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_until = db.Column(db.DateTime)
+    last_run_at = db.Column(db.DateTime)
+    last_duration = db.Column(db.Float)
+    last_result = db.Column(db.Text)
+    last_error = db.Column(db.Text)
+
+class SlowQuery(db.Model):
+    # Медленные SQL-запросы (см. slowlog.py); страница администратора группирует их по fingerprint
+    __tablename__ = 'slow_queries'
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(16), nullable=False)
+    statement = db.Column(db.Text, nullable=False)
+    parameter_shape = db.Column(db.Text)
+    endpoint = db.Column(db.String(100))
+    duration_ms = db.Column(db.Float, nullable=False)
+    plan = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (
+        db.Index('ix_slow_queries_fingerprint_created_at', 'fingerprint', 'created_at'),
+    )
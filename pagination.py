@@ -0,0 +1,96 @@
+import base64
+import json
+import time
+from flask import current_app
+from sqlalchemy import tuple_, literal, type_coerce, String
+from metrics import cache_hit, cache_miss
+
+# Кэш количества записей: ключ -> (значение, время вычисления)
+_count_cache = {}
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': values, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, direction = payload['v'], payload['d']
+    except (ValueError, KeyError, TypeError):
+        return None, None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None, None
+    return values, direction
+
+
+def cached_count(key, query):
+    # COUNT(*) по большим таблицам дорогой, поэтому кэшируем его на PAGINATION_COUNT_TTL секунд
+    ttl = current_app.config.get('PAGINATION_COUNT_TTL', 60)
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached and now - cached[1] < ttl:
+        cache_hit('counts')
+        return cached[0]
+    cache_miss('counts')
+    total = query.order_by(None).count()
+    _count_cache[key] = (total, now)
+    return total
+
+
+# Постраничный вывод по ключу (seek) вместо LIMIT/OFFSET: стоимость любой страницы одинакова.
+# columns - упорядочивающие столбцы, последний из них должен быть уникальным (обычно первичный ключ).
+# Курсоры next_cursor/prev_cursor непрозрачны для клиента и передаются в параметре cursor.
+class KeysetPagination:
+    def __init__(self, query, columns, per_page, cursor=None, descending=True, count_key=None):
+        self.per_page = per_page
+        self.total = cached_count(count_key, query) if count_key else None
+        values, direction = decode_cursor(cursor)
+        if values is not None and len(values) != len(columns):
+            values, direction = None, None
+
+        # Значения ключа берём в том виде, в каком они хранятся в БД, чтобы сравнение
+        # в SQLite шло по тем же строкам (например, created_at без микросекунд)
+        raw_columns = [type_coerce(column, String) for column in columns]
+        query = query.add_columns(*raw_columns)
+        backwards = direction == 'prev'
+        if values is not None:
+            key = tuple_(*columns)
+            bound = tuple_(*[literal(value) for value in values])
+            query = query.filter(key > bound if descending == backwards else key < bound)
+        if descending == backwards:
+            query = query.order_by(*[column.asc() for column in columns])
+        else:
+            query = query.order_by(*[column.desc() for column in columns])
+
+        rows = query.limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        if backwards:
+            rows.reverse()
+
+        self.items = [row[0] for row in rows]
+        self._first_key = list(rows[0][1:]) if rows else None
+        self._last_key = list(rows[-1][1:]) if rows else None
+        if backwards:
+            self.has_prev = has_more
+            self.has_next = True
+        else:
+            self.has_prev = values is not None
+            self.has_next = has_more
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or self._last_key is None:
+            return None
+        return encode_cursor(self._last_key, 'next')
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or self._first_key is None:
+            return None
+        return encode_cursor(self._first_key, 'prev')
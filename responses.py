@@ -0,0 +1,125 @@
+import hashlib
+import os
+import zlib
+from flask import Response, current_app, request, stream_with_context, url_for, get_flashed_messages
+from flask_wtf.csrf import generate_csrf
+
+try:
+    import brotli
+except ImportError:  # brotli не обязателен, без него ответы сжимаются gzip
+    brotli = None
+
+# Потоковая отрисовка больших страниц, сжатие ответов и статические файлы с отпечатком содержимого.
+#
+# Настройки приложения:
+#   STREAM_BUFFER_SIZE      - сколько фрагментов шаблона собирать перед отправкой очередной части (100)
+#   COMPRESS_ENABLED        - сжимать ответы gzip/brotli по заголовку Accept-Encoding (True)
+#   COMPRESS_MIN_SIZE       - ответы меньше этого размера в байтах не сжимаются (500)
+#   COMPRESS_LEVEL          - уровень gzip (6); для brotli - BROTLI_QUALITY (5)
+#   STATIC_ASSET_MAX_AGE    - срок кэширования статических файлов с отпечатком в секундах (1 год)
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/csv', 'text/plain', 'application/json', 'application/javascript')
+
+# Отпечатки статических файлов: имя -> (время изменения, отпечаток)
+_asset_hashes = {}
+
+
+def asset_url(filename):
+    # Адрес статического файла с отпечатком содержимого: после изменения файла адрес меняется,
+    # поэтому файл можно кэшировать в браузере без проверки актуальности
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _asset_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+        _asset_hashes[filename] = cached
+    return url_for('static', filename=filename, v=cached[1])
+
+
+def stream_page(template_name, **context):
+    # Аналог render_template, отдающий страницу частями по мере отрисовки: первые байты (заголовок,
+    # формы) уходят клиенту до того, как отрисована вся таблица
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(template_name)
+    # Сессия сохраняется до отправки тела, поэтому сообщения flash забираются из неё заранее;
+    # шаблон получит их из кэша запроса. Так же заранее создаётся CSRF-токен: если его ещё нет в сессии,
+    # созданный во время отрисовки токен не попал бы в cookie и формы страницы не прошли бы проверку.
+    get_flashed_messages()
+    generate_csrf()
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(app.config.get('STREAM_BUFFER_SIZE', 100))
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compressor(encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=current_app.config.get('BROTLI_QUALITY', 5))
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(current_app.config.get('COMPRESS_LEVEL', 6), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compress_stream(chunks, compressor):
+    # Каждая часть потокового ответа сжимается и сразу отправляется (flush), чтобы не задерживать вывод.
+    # Тело читается уже после выхода из контекста запроса, поэтому компрессор создаётся заранее.
+    compress, flush, finish = compressor
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response):
+    if (not current_app.config.get('COMPRESS_ENABLED', True) or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304) or request.method == 'HEAD'
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, _compressor(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+            return response
+        compress, _, finish = _compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое тело отличается побайтно, поэтому сильный ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_responses(app):
+    @app.context_processor
+    def _asset_url():
+        return {'asset_url': asset_url}
+
+    @app.after_request
+    def _after_request(response):
+        if request.endpoint == 'static' and 'v' in request.args:
+            # Адрес с отпечатком никогда не указывает на другое содержимое
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config.get('STATIC_ASSET_MAX_AGE', 31536000)
+            response.cache_control.immutable = True
+        return compress_response(response)
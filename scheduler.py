@@ -0,0 +1,203 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, delete, or_
+from sqlalchemy.dialects.sqlite import insert
+from models import db, ScheduledJob, PasswordResetToken, Invitation, SlowQuery
+from cache import warm_references
+from security import purge_rate_limits
+from database import optimize_database
+from archive import archive_logs
+
+# Периодические задачи обслуживания в фоновом потоке каждого процесса.
+#
+# Общие задачи (shared=True) выполняет только один процесс: перед запуском он забирает задачу условным
+# UPDATE таблицы scheduled_jobs (аренда на SCHEDULER_LEASE_SECONDS), там же хранится время следующего
+# запуска и результат последнего. Локальные задачи (shared=False, например прогрев кэша процесса)
+# выполняются в каждом процессе.
+#
+# Настройки приложения:
+#   SCHEDULER_ENABLED        - запускать фоновый поток (по умолчанию True); без него задачи можно
+#                              запускать из cron командой `flask run-jobs`
+#   SCHEDULER_POLL_INTERVAL  - период проверки задач в секундах (60)
+#   SCHEDULER_LEASE_SECONDS  - сколько секунд задача считается занятой упавшим процессом (600)
+#   SCHEDULER_INTERVALS      - {'имя задачи': период в секундах}, 0 отключает задачу
+#   MAINTENANCE_BATCH_SIZE   - сколько строк удалять за одну транзакцию (500)
+#   MAINTENANCE_BATCH_PAUSE  - пауза между пакетами в секундах, чтобы не занимать запись надолго (0.05)
+
+JOBS = {}
+
+
+def register_job(name, func, interval, shared=True):
+    # func вызывается без аргументов в контексте приложения и возвращает краткий результат для журнала
+    JOBS[name] = (func, interval, shared)
+
+
+def job_interval(app, name):
+    return app.config.get('SCHEDULER_INTERVALS', {}).get(name, JOBS[name][1])
+
+
+def purge_in_batches(model, key, condition):
+    # Удаляет строки небольшими пакетами, каждый в своей транзакции. Возвращает число удалённых строк.
+    batch_size = current_app.config.get('MAINTENANCE_BATCH_SIZE', 500)
+    pause = current_app.config.get('MAINTENANCE_BATCH_PAUSE', 0.05)
+    total = 0
+    while True:
+        batch = select(key).where(condition).limit(batch_size).scalar_subquery()
+        deleted = db.session.execute(delete(model).where(key.in_(batch))).rowcount
+        db.session.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def purge_reset_tokens():
+    return purge_in_batches(PasswordResetToken, PasswordResetToken.token_id,
+                            PasswordResetToken.expires_at < datetime.utcnow())
+
+
+def purge_invitations():
+    return purge_in_batches(Invitation, Invitation.invitation_id,
+                            or_(Invitation.used.is_(True), Invitation.expires_at < datetime.utcnow()))
+
+
+def purge_slow_queries():
+    # Журнал медленных запросов хранится SLOW_QUERY_RETENTION_DAYS дней (30)
+    since = datetime.utcnow() - timedelta(days=current_app.config.get('SLOW_QUERY_RETENTION_DAYS', 30))
+    return purge_in_batches(SlowQuery, SlowQuery.id, SlowQuery.created_at < since)
+
+
+def optimize_db():
+    optimize_database(current_app.config.get('SCHEDULER_ANALYZE', False))
+    return 'ok'
+
+
+register_job('purge_reset_tokens', purge_reset_tokens, 3600)
+register_job('purge_invitations', purge_invitations, 3600)
+register_job('purge_rate_limits', purge_rate_limits, 3600)
+register_job('purge_slow_queries', purge_slow_queries, 86400)
+register_job('optimize_db', optimize_db, 86400)
+# Архивация меняет состав журнала, поэтому по умолчанию выключена: SCHEDULER_INTERVALS = {'archive_logs': 86400}
+register_job('archive_logs', archive_logs, 0)
+# Кэш справочников свой у каждого процесса
+register_job('warm_cache', warm_references, 300, shared=False)
+
+
+def _owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _claim(app, name, force=False):
+    # Условный UPDATE гарантирует, что общую задачу в данный момент выполняет только один процесс
+    now = datetime.utcnow()
+    db.session.execute(insert(ScheduledJob).values(name=name, next_run_at=now).on_conflict_do_nothing())
+    conditions = [ScheduledJob.name == name,
+                  or_(ScheduledJob.locked_until.is_(None), ScheduledJob.locked_until < now)]
+    if not force:
+        conditions.append(ScheduledJob.next_run_at <= now)
+    lease = now + timedelta(seconds=app.config.get('SCHEDULER_LEASE_SECONDS', 600))
+    result = db.session.execute(update(ScheduledJob).where(*conditions).values(locked_by=_owner(), locked_until=lease))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def _finish(app, name, started_at, duration, result, error):
+    db.session.execute(
+        update(ScheduledJob).where(ScheduledJob.name == name, ScheduledJob.locked_by == _owner()).values(
+            next_run_at=started_at + timedelta(seconds=job_interval(app, name)),
+            locked_by=None,
+            locked_until=None,
+            last_run_at=started_at,
+            last_duration=duration,
+            last_result=None if result is None else str(result),
+            last_error=error,
+        )
+    )
+    db.session.commit()
+
+
+# Время следующего запуска локальных задач в этом процессе
+_local_next_run = {}
+
+
+def _run_job(app, name):
+    func, _, shared = JOBS[name]
+    started_at = datetime.utcnow()
+    start = time.perf_counter()
+    result = error = None
+    try:
+        result = func()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception(f"Ошибка задачи обслуживания {name}")
+        error = str(e)
+    if shared:
+        _finish(app, name, started_at, time.perf_counter() - start, result, error)
+    else:
+        _local_next_run[name] = time.monotonic() + job_interval(app, name)
+    return result, error
+
+
+def run_due_jobs(app, names=None, force=False):
+    # Выполняет задачи, срок которых наступил (force - все указанные). Возвращает [(имя, результат, ошибка)].
+    done = []
+    for name in names or JOBS:
+        if not job_interval(app, name) and not force:
+            continue
+        shared = JOBS[name][2]
+        if shared:
+            if not _claim(app, name, force):
+                continue
+        elif not force and _local_next_run.get(name, 0) > time.monotonic():
+            continue
+        result, error = _run_job(app, name)
+        done.append((name, result, error))
+    return done
+
+
+class SchedulerWorker(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='maintenance-scheduler', daemon=True)
+        self.app = app
+
+    def run(self):
+        interval = self.app.config.get('SCHEDULER_POLL_INTERVAL', 60)
+        while True:
+            with self.app.app_context():
+                try:
+                    run_due_jobs(self.app)
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception("Ошибка планировщика задач обслуживания")
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+
+# Один поток планировщика на процесс; после fork воркера поток запускается заново
+_worker = None
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def start_scheduler(app):
+    global _worker, _worker_pid
+    if not app.config.get('SCHEDULER_ENABLED', True):
+        return None
+    with _worker_lock:
+        if _worker is None or _worker_pid != os.getpid() or not _worker.is_alive():
+            _worker = SchedulerWorker(app)
+            _worker_pid = os.getpid()
+            _worker.start()
+    return _worker
+
+
+def init_scheduler(app):
+    @app.before_request
+    def _ensure_scheduler():
+        if _worker is None or _worker_pid != os.getpid():
+            start_scheduler(app)
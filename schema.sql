@@ -92,4 +92,168 @@ CREATE TABLE logs (
     details TEXT, -- JSON or text with details
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users (user_id)
-);
\ No newline at end of file
+);
+
+CREATE TABLE log_changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    log_id INTEGER NOT NULL,
+    field TEXT NOT NULL, -- имя поля из details
+    old_value TEXT,
+    new_value TEXT,
+    changed BOOLEAN NOT NULL DEFAULT TRUE, -- для 'update': изменилось ли поле
+    FOREIGN KEY (log_id) REFERENCES logs (log_id)
+);
+
+CREATE TABLE data_versions (
+    name TEXT PRIMARY KEY, -- 'clients', 'gateways', 'terminals', 'roles', 'export_contracts', 'users', 'general_data'
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+
+CREATE TABLE email_outbox (
+    email_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'sending', 'sent', 'failed'
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMP NOT NULL,
+    locked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE TABLE rate_limits (
+    key TEXT PRIMARY KEY, -- '<ограничение>:<IP или email>'
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL -- время Unix
+);
+
+-- Число отгрузок за день в разрезе клиента, шлюза и терминала (главная страница), поддерживается триггерами
+CREATE TABLE shipment_counters (
+    day DATE NOT NULL,
+    client_id INTEGER NOT NULL REFERENCES clients (client_id),
+    gateway_id INTEGER NOT NULL REFERENCES gateways (gateway_id),
+    terminal_id INTEGER NOT NULL REFERENCES terminals (terminal_id),
+    shipments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, client_id, gateway_id, terminal_id)
+);
+
+-- Периодические задачи обслуживания (scheduler.py)
+CREATE TABLE scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    next_run_at TIMESTAMP NOT NULL,
+    locked_by TEXT, -- 'хост:pid' процесса, выполняющего задачу
+    locked_until TIMESTAMP,
+    last_run_at TIMESTAMP,
+    last_duration REAL, -- секунды
+    last_result TEXT,
+    last_error TEXT
+);
+
+-- Медленные SQL-запросы (slowlog.py)
+CREATE TABLE slow_queries (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL, -- sha1 нормализованного текста запроса (16 символов)
+    statement TEXT NOT NULL, -- текст с литералами, заменёнными на ?
+    parameter_shape TEXT, -- типы параметров без значений
+    endpoint TEXT, -- endpoint запроса или имя фонового потока
+    duration_ms REAL NOT NULL,
+    plan TEXT, -- EXPLAIN QUERY PLAN
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX ix_general_data_created_at_id ON general_data (created_at, id);
+CREATE INDEX ix_general_data_client_id_created_at_id ON general_data (client_id, created_at, id);
+CREATE INDEX ix_general_data_gateway_id_created_at_id ON general_data (gateway_id, created_at, id);
+CREATE INDEX ix_general_data_terminal_id_created_at_id ON general_data (terminal_id, created_at, id);
+CREATE INDEX ix_general_data_export_contract_id_created_at_id ON general_data (export_contract_id, created_at, id);
+CREATE INDEX ix_general_data_user_id_created_at_id ON general_data (user_id, created_at, id);
+CREATE INDEX ix_general_data_invoice_number_id ON general_data (invoice_number, id);
+CREATE INDEX ix_general_data_vehicle_id ON general_data (coalesce(vehicle, ''), id);
+CREATE INDEX ix_general_data_delivery_address_id ON general_data (coalesce(delivery_address, ''), id);
+CREATE INDEX ix_export_contracts_client_id ON export_contracts (client_id);
+CREATE INDEX ix_logs_created_at ON logs (created_at);
+CREATE INDEX ix_logs_table_name_record_id_log_id ON logs (table_name, record_id, log_id);
+CREATE INDEX ix_logs_user_id_log_id ON logs (user_id, log_id);
+CREATE INDEX ix_log_changes_log_id ON log_changes (log_id);
+CREATE INDEX ix_log_changes_field_new_value ON log_changes (field, new_value);
+CREATE INDEX ix_log_changes_field_old_value ON log_changes (field, old_value);
+CREATE INDEX ix_invitations_used_expires_at ON invitations (used, expires_at);
+CREATE INDEX ix_password_reset_tokens_user_id ON password_reset_tokens (user_id);
+CREATE INDEX ix_email_outbox_status_next_attempt_at ON email_outbox (status, next_attempt_at);
+CREATE INDEX ix_slow_queries_created_at ON slow_queries (created_at);
+CREATE INDEX ix_slow_queries_fingerprint_created_at ON slow_queries (fingerprint, created_at);
+
+-- Полнотекстовый поиск по general_data, синхронизируется триггерами
+CREATE VIRTUAL TABLE general_data_fts USING fts5(
+    invoice_number, vehicle, delivery_address,
+    content='general_data', content_rowid='id', tokenize='trigram'
+);
+
+CREATE TRIGGER general_data_fts_ai AFTER INSERT ON general_data BEGIN
+    INSERT INTO general_data_fts (rowid, invoice_number, vehicle, delivery_address)
+    VALUES (new.id, new.invoice_number, new.vehicle, new.delivery_address);
+END;
+
+CREATE TRIGGER general_data_fts_ad AFTER DELETE ON general_data BEGIN
+    INSERT INTO general_data_fts (general_data_fts, rowid, invoice_number, vehicle, delivery_address)
+    VALUES ('delete', old.id, old.invoice_number, old.vehicle, old.delivery_address);
+END;
+
+CREATE TRIGGER general_data_fts_au AFTER UPDATE OF invoice_number, vehicle, delivery_address ON general_data BEGIN
+    INSERT INTO general_data_fts (general_data_fts, rowid, invoice_number, vehicle, delivery_address)
+    VALUES ('delete', old.id, old.invoice_number, old.vehicle, old.delivery_address);
+    INSERT INTO general_data_fts (rowid, invoice_number, vehicle, delivery_address)
+    VALUES (new.id, new.invoice_number, new.vehicle, new.delivery_address);
+END;
+
+-- Версия general_data для ETag/Last-Modified в API
+CREATE TRIGGER general_data_version_ai AFTER INSERT ON general_data BEGIN
+    INSERT INTO data_versions (name, version, updated_at) VALUES ('general_data', 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER general_data_version_au AFTER UPDATE ON general_data BEGIN
+    INSERT INTO data_versions (name, version, updated_at) VALUES ('general_data', 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER general_data_version_ad AFTER DELETE ON general_data BEGIN
+    INSERT INTO data_versions (name, version, updated_at) VALUES ('general_data', 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+-- Счётчики отгрузок, синхронизируются с general_data триггерами
+CREATE INDEX ix_shipment_counters_client_id_day ON shipment_counters (client_id, day);
+
+CREATE TRIGGER shipment_counters_ai AFTER INSERT ON general_data WHEN new.created_at IS NOT NULL BEGIN
+    INSERT INTO shipment_counters (day, client_id, gateway_id, terminal_id, shipments)
+    VALUES (date(new.created_at), new.client_id, new.gateway_id, new.terminal_id, 1)
+    ON CONFLICT (day, client_id, gateway_id, terminal_id) DO UPDATE SET shipments = shipments + 1;
+END;
+
+CREATE TRIGGER shipment_counters_ad AFTER DELETE ON general_data WHEN old.created_at IS NOT NULL BEGIN
+    UPDATE shipment_counters SET shipments = shipments - 1
+    WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id;
+    DELETE FROM shipment_counters
+    WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id
+        AND shipments <= 0;
+END;
+
+CREATE TRIGGER shipment_counters_au AFTER UPDATE OF created_at, client_id, gateway_id, terminal_id ON general_data
+WHEN date(old.created_at) IS NOT date(new.created_at) OR old.client_id != new.client_id
+    OR old.gateway_id != new.gateway_id OR old.terminal_id != new.terminal_id BEGIN
+    UPDATE shipment_counters SET shipments = shipments - 1
+    WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id;
+    DELETE FROM shipment_counters
+    WHERE day = date(old.created_at) AND client_id = old.client_id AND gateway_id = old.gateway_id AND terminal_id = old.terminal_id
+        AND shipments <= 0;
+    INSERT INTO shipment_counters (day, client_id, gateway_id, terminal_id, shipments)
+    SELECT date(new.created_at), new.client_id, new.gateway_id, new.terminal_id, 1 WHERE new.created_at IS NOT NULL
+    ON CONFLICT (day, client_id, gateway_id, terminal_id) DO UPDATE SET shipments = shipments + 1;
+END;
+
+-- Версия схемы для migrations.py
+PRAGMA user_version = 11;
\ No newline at end of file
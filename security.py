@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app, flash, redirect, request
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+from models import db, RateLimit
+
+# Хэширование паролей и ограничение частоты попыток входа.
+#
+# Хэширование (scrypt/pbkdf2) занимает десятки миллисекунд процессора, поэтому выполняется в ограниченном
+# пуле потоков (hashlib отпускает GIL). Настройки:
+#   PASSWORD_HASH_METHOD   - метод и стоимость для generate_password_hash, например 'scrypt:32768:8:1'
+#                            или 'pbkdf2:sha256:600000' (по умолчанию - метод Werkzeug). Хэши со старыми
+#                            параметрами пересчитываются при следующем успешном входе.
+#   PASSWORD_HASH_WORKERS  - потоков хэширования на процесс (по числу процессоров)
+#   PASSWORD_HASH_QUEUE    - сколько задач может ждать сверх занятых потоков; остальные получают отказ (16)
+#   PASSWORD_HASH_TIMEOUT  - сколько секунд ждать результата (10)
+#
+# Частота попыток ограничивается "ведром токенов" в таблице rate_limits, общей для всех процессов.
+# RATE_LIMITS: имя -> (ёмкость ведра, за сколько секунд оно наполняется полностью).
+
+RATE_LIMITS = {
+    'login_ip': (20, 60),
+    'login_account': (5, 300),
+    'forgot_password_ip': (10, 3600),
+    'forgot_password_account': (3, 3600),
+}
+
+
+class PasswordHashBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid, _slots
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            workers = current_app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(workers + current_app.config.get('PASSWORD_HASH_QUEUE', 16))
+            _executor_pid = os.getpid()
+    return _executor, _slots
+
+
+def _run(func, *args):
+    executor, slots = _get_executor()
+    # Очередь ограничена: при перегрузке запрос сразу получает отказ, а не ждёт за сотней других
+    if not slots.acquire(blocking=False):
+        raise PasswordHashBusy()
+    try:
+        future = executor.submit(func, *args)
+    except RuntimeError:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=current_app.config.get('PASSWORD_HASH_TIMEOUT', 10))
+    except FutureTimeout:
+        # Пул не успел: запрос получает тот же отказ, что и при переполненной очереди
+        raise PasswordHashBusy() from None
+
+
+def _method():
+    return current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, _method())
+
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+
+def _method_prefix(method):
+    # Полная форма метода, которую generate_password_hash записывает в хэш: 'scrypt' -> 'scrypt:32768:8:1',
+    # 'pbkdf2' -> 'pbkdf2:sha256:600000'. Вычисляется по строке настройки, без пробного хэширования.
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        args = [2 ** 15, 8, 1]
+    elif name == 'pbkdf2' and len(args) < 2:
+        args = (args or ['sha256']) + [DEFAULT_PBKDF2_ITERATIONS]
+    return ':'.join([name, *map(str, args)])
+
+
+def needs_rehash(password_hash):
+    # Хэш пересчитывается, если его параметры отличаются от текущего PASSWORD_HASH_METHOD
+    return password_hash.split('$', 1)[0] != _method_prefix(_method())
+
+
+def consume(name, key):
+    # Забирает токен из ведра name:key. Возвращает False, если попытки исчерпаны.
+    # Один UPSERT с условием выполняется атомарно, поэтому лимит соблюдается и между процессами.
+    capacity, period = current_app.config.get('RATE_LIMITS', {}).get(name, RATE_LIMITS[name])
+    rate = capacity / period
+    now = time.time()
+    refilled = db.func.min(capacity, RateLimit.tokens + (now - RateLimit.updated_at) * rate)
+    statement = insert(RateLimit).values(key=f'{name}:{key}', tokens=capacity - 1, updated_at=now).on_conflict_do_update(
+        index_elements=[RateLimit.key],
+        set_={'tokens': refilled - 1, 'updated_at': now},
+        where=refilled >= 1
+    )
+    # Отдельная транзакция: попытка учитывается, даже если запрос затем откатит свою сессию
+    with db.engine.begin() as connection:
+        return connection.execute(statement).rowcount == 1
+
+
+def throttle(action, account):
+    # Проверка лимитов по IP и по учётной записи до любой работы с паролем
+    if not consume(f'{action}_ip', request.remote_addr or 'unknown'):
+        return False
+    if account and not consume(f'{action}_account', account.strip().lower()):
+        return False
+    return True
+
+
+def purge_rate_limits(older_than=86400):
+    # Удаляет вёдра, не использовавшиеся дольше older_than секунд (они давно полные)
+    result = db.session.execute(delete(RateLimit).where(RateLimit.updated_at < time.time() - older_than))
+    db.session.commit()
+    return result.rowcount
+
+
+def init_security(app):
+    @app.errorhandler(PasswordHashBusy)
+    def _password_hash_busy(e):
+        flash('Сервер перегружен, повторите попытку через несколько секунд.', 'error')
+        return redirect(request.url)
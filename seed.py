@@ -0,0 +1,50 @@
+from models import db, Role, User
+from security import hash_password
+
+# Начальные данные: роли и первый администратор. Повторный вызов ничего не дублирует, поэтому
+# команды `flask init-db` и `flask create-admin` можно запускать при каждой выкладке.
+
+ROLES = [
+    ('Администратор', 'Полный доступ к системе'),
+    ('Менеджер', 'Управление клиентами'),
+    ('Декларант', 'Ограниченный доступ'),
+]
+
+
+def ensure_role(name, description):
+    role = Role.query.filter_by(name=name).first()
+    if not role:
+        role = Role(name=name, description=description)
+        db.session.add(role)
+        db.session.flush()
+    return role
+
+
+def seed_roles():
+    # Добавляет недостающие роли. Возвращает имена добавленных.
+    existing = {name for name, in db.session.query(Role.name)}
+    added = [name for name, description in ROLES if name not in existing]
+    for name, description in ROLES:
+        ensure_role(name, description)
+    db.session.commit()
+    return added
+
+
+def create_admin(username, email, password):
+    # Создаёт администратора. Если пользователь с таким именем или email уже есть, возвращает
+    # (None, сообщение), иначе (пользователь, None).
+    if User.query.filter_by(username=username).first():
+        return None, f"Пользователь с именем {username} уже существует."
+    if User.query.filter_by(email=email).first():
+        return None, f"Пользователь с email {email} уже существует."
+    admin_role = ensure_role(*ROLES[0])
+    admin = User(
+        username=username,
+        email=email,
+        password_hash=hash_password(password),
+        role_id=admin_role.role_id,
+        is_active=True
+    )
+    db.session.add(admin)
+    db.session.commit()
+    return admin, None
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import event, insert
+from models import db, SlowQuery
+
+# Журнал медленных SQL-запросов.
+#
+# Все запросы через db.engine замеряются событиями курсора. Медленный запрос сохраняется в таблицу
+# slow_queries: нормализованный текст (литералы и списки IN заменены на ?), отпечаток нормализованного
+# текста, типы параметров без значений, endpoint или имя фонового потока и план EXPLAIN QUERY PLAN.
+# Записи сохраняются фоновым потоком, чтобы не удлинять и без того медленный запрос.
+# Сводка по отпечаткам - на странице /admin/slow_queries.
+#
+# Настройки приложения:
+#   SLOW_QUERY_THRESHOLD_MS      - порог в миллисекундах (100, 0 - отключить журнал)
+#   SLOW_QUERY_EXPLAIN_INTERVAL  - план снимается для отпечатка не чаще раза в столько секунд в процессе (3600)
+#   SLOW_QUERY_BUFFER_LIMIT      - сколько записей держать в памяти до сохранения, лишние отбрасываются (1000)
+#   SLOW_QUERY_FLUSH_INTERVAL    - как часто сохранять записи, секунды (2.0)
+#   SLOW_QUERY_RETENTION_DAYS    - сколько дней хранить записи, их удаляет задача purge_slow_queries (30)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+_VALUES_ROWS = re.compile(r'(\(\?(?:, \?)*\))(?:, \(\?(?:, \?)*\))+')
+_SPACES = re.compile(r'\s+')
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def normalize(statement):
+    statement = _SPACES.sub(' ', statement).strip()
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _IN_LIST.sub('IN (?, ...)', statement)
+    return _VALUES_ROWS.sub(r'\1, ...', statement)
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def _type_names(values):
+    # Подряд идущие одинаковые типы сворачиваются: int x 300, str
+    names = []
+    for value in values:
+        name = type(value).__name__
+        if names and names[-1][0] == name:
+            names[-1][1] += 1
+        else:
+            names.append([name, 1])
+    return ', '.join(name if count == 1 else f'{name} x {count}' for name, count in names)
+
+
+def parameter_shape(parameters, executemany=False):
+    if executemany:
+        return f'{len(parameters)} строк: {parameter_shape(parameters[0])}' if parameters else ''
+    if isinstance(parameters, dict):
+        return ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items())
+    return _type_names(parameters or ())
+
+
+def _plan(dbapi_connection, statement, parameters):
+    # Дерево плана с отступами по уровню вложенности, как в консоли sqlite3
+    rows = dbapi_connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
+
+
+def _source():
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+
+class SlowQueryWriter(threading.Thread):
+    def __init__(self, app):
+        super().__init__(name='slow-query-writer', daemon=True)
+        self.app = app
+        self.limit = app.config.get('SLOW_QUERY_BUFFER_LIMIT', 1000)
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def add(self, row):
+        with self.lock:
+            # При лавине медленных запросов лишние записи отбрасываются, а не копятся в памяти
+            if len(self.buffer) < self.limit:
+                self.buffer.append(row)
+        self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return
+        with self.app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(SlowQuery), batch)
+            except Exception:
+                self.app.logger.exception("Ошибка записи журнала медленных запросов")
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.app.config.get('SLOW_QUERY_FLUSH_INTERVAL', 2.0))
+            self.wakeup.clear()
+            self.flush()
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+# Когда последний раз снимался план: отпечаток -> time.monotonic()
+_explained = {}
+
+
+def _get_writer(app):
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = SlowQueryWriter(app)
+            _writer_pid = os.getpid()
+            _writer.start()
+    return _writer
+
+
+def flush_slow_queries():
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.flush()
+
+
+def init_slowlog(app):
+    threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS', 100)
+    if not threshold:
+        return
+    explain_interval = app.config.get('SLOW_QUERY_EXPLAIN_INTERVAL', 3600)
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slowlog_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - conn.info['slowlog_start'].pop()) * 1000
+        # Записи самого журнала не замеряются, иначе медленная запись порождала бы новые
+        if duration_ms < threshold or 'slow_queries' in statement:
+            return
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        plan = None
+        now = time.monotonic()
+        keyword = (statement.lstrip().split(None, 1) or [''])[0].upper()
+        if keyword in EXPLAINABLE and now - _explained.get(key, -explain_interval) >= explain_interval:
+            _explained[key] = now
+            try:
+                plan = _plan(cursor.connection, statement, parameters[0] if executemany else parameters)
+            except sqlite3.Error:
+                plan = None
+        _get_writer(app).add({
+            'fingerprint': key,
+            'statement': normalized,
+            'parameter_shape': parameter_shape(parameters, executemany),
+            'endpoint': _source(),
+            'duration_ms': duration_ms,
+            'plan': plan,
+            'created_at': datetime.utcnow(),
+        })
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        if context.connection is not None and context.connection.info.get('slowlog_start'):
+            context.connection.info['slowlog_start'].pop()
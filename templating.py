@@ -0,0 +1,78 @@
+import os
+import threading
+from collections import OrderedDict
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from cache import get_version
+from metrics import cache_hit, cache_miss
+
+# Ускорение шаблонов Jinja.
+#
+# Байткод скомпилированных шаблонов сохраняется на диск и используется всеми процессами, поэтому новый
+# воркер после перезапуска не компилирует шаблоны заново (а `flask compile-templates` при выкладке
+# заполняет кэш заранее). Настройки:
+#   JINJA_BYTECODE_CACHE      - включить кэш байткода (True)
+#   JINJA_BYTECODE_CACHE_DIR  - каталог кэша (по умолчанию - подкаталог временного каталога пользователя)
+#   FRAGMENT_CACHE_SIZE       - сколько отрисованных фрагментов хранить в процессе (500, 0 - отключить)
+#
+# Тег {% cache 'имя', ['clients', ...], ключ1, ключ2 %}...{% endcache %} сохраняет отрисованный фрагмент.
+# Фрагмент переиспользуется, пока не изменились версии указанных данных (таблица data_versions)
+# и дополнительные ключи. Во фрагмент нельзя помещать то, что зависит от пользователя или сессии
+# (сообщения flash, CSRF-токены), если это не входит в ключи.
+
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        if len(args) < 2:
+            parser.fail('Тегу cache нужны имя фрагмента и список данных, от которых он зависит', lineno)
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        name, versions, keys = args[0], args[1], nodes.List(args[2:])
+        return nodes.CallBlock(self.call_method('_render', [name, versions, keys]), [], [], body).set_lineno(lineno)
+
+    def _render(self, name, versions, keys, caller):
+        size = current_app.config.get('FRAGMENT_CACHE_SIZE', 500)
+        if not size:
+            return caller()
+        key = (name, tuple((version, get_version(version)) for version in versions), repr(keys))
+        with _fragments_lock:
+            cached = _fragments.get(key)
+            if cached is not None:
+                _fragments.move_to_end(key)
+                cache_hit('fragments')
+                return cached
+        cache_miss('fragments')
+        rendered = Markup(caller())
+        with _fragments_lock:
+            _fragments[key] = rendered
+            # Фрагменты устаревших версий не запрашиваются и вытесняются первыми
+            while len(_fragments) > size:
+                _fragments.popitem(last=False)
+        return rendered
+
+
+def compile_templates(app):
+    # Загружает все шаблоны приложения, чтобы их байткод попал в кэш. Возвращает число шаблонов.
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def init_templating(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config.get('JINJA_BYTECODE_CACHE', True):
+        directory = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
@@ -1,7 +1,8 @@
-import smtplib
-from email.mime.text import MIMEText
+from datetime import datetime, timedelta
 from flask import url_for
-from email_config import SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, FROM_EMAIL
+from sqlalchemy import type_coerce, String, Integer, text
+from models import db
+from mailer import enqueue_email, wake_worker
 
 def send_reset_email(to_email, token):
     reset_url = url_for('auth.reset_password', token=token, _external=True)
@@ -17,17 +18,47 @@ def send_reset_email(to_email, token):
     С уважением,
     Команда ERP
     '''
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = FROM_EMAIL
-    msg['To'] = to_email
+    # Письмо ставится в очередь и отправляется фоновым потоком, см. mailer.py
+    email = enqueue_email(to_email, subject, body)
+    db.session.commit()
+    wake_worker()
+    return email
 
+
+def parse_date(value):
+    # Дата из параметра запроса в формате ГГГГ-ММ-ДД; None, если параметр пуст или некорректен
     try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(FROM_EMAIL, to_email, msg.as_string())
-    except Exception as e:
-        print(f"Ошибка отправки email: {e}")
-        return False
-    return True
\ No newline at end of file
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+
+def created_between(column, date_from=None, date_to=None):
+    # Условия по диапазону дат [date_from, date_to] включительно. Сравнение идёт со строками ГГГГ-ММ-ДД,
+    # потому что SQLite хранит created_at как текст с микросекундами или без них
+    column = type_coerce(column, String)
+    conditions = []
+    if date_from:
+        conditions.append(column >= date_from.isoformat())
+    if date_to:
+        conditions.append(column < (date_to + timedelta(days=1)).isoformat())
+    return conditions
+
+
+def fts_query(value):
+    # Строка поиска -> запрос FTS5: каждое слово ищется как подстрока (все слова обязательны).
+    # Триграммный индекс не находит подстроки короче 3 символов, такие слова отбрасываются.
+    # Возвращает None, если искать нечего.
+    words = [word for word in (value or '').split() if len(word) >= 3]
+    if not words:
+        return None
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def search_general_data(column, query):
+    # Условие "id записи найден в general_data_fts" для фильтрации без LIKE '%...%'
+    return column.in_(
+        text('SELECT rowid FROM general_data_fts WHERE general_data_fts MATCH :fts_query')
+        .bindparams(fts_query=query)
+        .columns(rowid=Integer)
+    )
@@ -0,0 +1,21 @@
+from app import create_app
+from models import db
+from cache import warm_references
+from templating import compile_templates
+
+# Точка входа WSGI для рабочего режима с несколькими процессами:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# С preload_app (gunicorn.conf.py) модуль выполняется один раз в главном процессе до запуска воркеров:
+# импорт зависимостей, создание приложения, компиляция шаблонов и загрузка справочников достаются
+# воркерам готовыми, и новый воркер после перезапуска сразу принимает запросы.
+# Фоновые потоки и соединения с базой каждый воркер открывает сам при первом запросе.
+
+app = create_app()
+
+with app.app_context():
+    compile_templates(app)
+    warm_references()
+    # Соединения, открытые при разогреве, не передаются воркерам: соединение SQLite нельзя
+    # использовать из нескольких процессов
+    db.engine.dispose()